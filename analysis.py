@@ -1,20 +1,33 @@
-import pandas as pd
-import matplotlib.pyplot as plt
+import argparse
 import json
 
+import pandas as pd
+
+import plotting
 
 
 def plot_top_schemas(df, top_n):
-    schema_counts = df['url'].value_counts().head(top_n)
+    if 'urls' in df:
+        # Files matched by several schema URLs list all of them in one column
+        urls = df['urls'].str.split(' ').explode()
+    else:
+        urls = df['url']
+    schema_counts = urls.value_counts().head(top_n)
     print(schema_counts[:10])
 
-    for url in schema_counts:
-        print(f"{url[0]} - {url[1]}")
+    for url, count in schema_counts.items():
+        print(f"{url} - {count}")
 
     schema_counts.index = [url.replace('https://', '').replace('http://', '') for url in schema_counts.index]
 
     schema_counts.index = [url if len(url) < 40 else url[:37] + '...' for url in schema_counts.index]
 
+    plotting.render(_draw_top_schemas, schema_counts, top_n)
+
+
+def _draw_top_schemas(schema_counts, top_n):
+    plt = plotting.get_pyplot()
+
     plt.figure(figsize=(12, 8))
     schema_counts.plot(kind='bar', color='lightblue')
     plt.title(f'Top {top_n} Most Used Schemas', fontsize=14)
@@ -24,7 +37,7 @@ def plot_top_schemas(df, top_n):
     plt.xticks(rotation=45, ha='right')
     plt.tight_layout()
 
-    plt.show()
+    plotting.show('top_schemas')
 
 
 def get_most_least_frequent_commits(json_file):
@@ -54,6 +67,15 @@ def get_most_least_frequent_commits(json_file):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output_folder", default=None,
+                        help="write figures to this folder instead of showing them")
+    parser.add_argument("--image_format", default="png", choices=["png", "svg"])
+    args = parser.parse_args()
+
+    if args.output_folder:
+        plotting.configure(args.output_folder, args.image_format)
+
     # Set options to display the full DataFrame without truncation
     pd.set_option('display.max_rows', None)  # Show all rows
     pd.set_option('display.max_columns', None)  # Show all columns
@@ -61,4 +83,6 @@ if __name__ == '__main__':
     df = pd.read_csv('more_repos_with_json_schema.csv')
 
     plot_top_schemas(df, top_n=10)
-    get_most_least_frequent_commits('commits.json')
\ No newline at end of file
+    get_most_least_frequent_commits('commits.json')
+
+    plotting.wait()
\ No newline at end of file
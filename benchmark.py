@@ -0,0 +1,305 @@
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+STAGES = ["enumeration", "tag_extraction", "difference_analysis", "validation", "splitting"]
+
+# Modules are imported before a stage is timed so import time is not counted
+STAGE_MODULES = {
+    "enumeration": "compare_doc_schema",
+    "tag_extraction": "compare_doc_schema",
+    "difference_analysis": "compare_doc_schema",
+    "validation": "validate_schemas",
+    "splitting": "train_split",
+}
+
+SCHEMA_DRAFT = "http://json-schema.org/draft-07/schema#"
+
+
+def encode_url(url):
+    encoded_url = (url.replace("https://", "https__slash__slash_")
+                   .replace("http://", "http__slash__slash_")
+                   .replace("/", "__slash__")
+                   .replace(":", "__colon__")
+                   .replace("?", "__question__"))
+
+    # Ensuring file ends with .json and not .json.json
+    if encoded_url.endswith(".json"):
+        return encoded_url
+    else:
+        return encoded_url + ".json"
+
+
+def make_schema_properties(rng, fan_out, depth, prefix):
+    properties = {}
+    for i in range(fan_out):
+        name = f"{prefix}{i}"
+        if depth > 1 and rng.random() < 0.3:
+            properties[name] = {
+                "type": "object",
+                "properties": make_schema_properties(rng, fan_out, depth - 1, name + "_"),
+            }
+        elif depth > 1 and rng.random() < 0.1:
+            properties[name] = {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": make_schema_properties(rng, fan_out, depth - 1, name + "_"),
+                },
+            }
+        else:
+            properties[name] = {"type": rng.choice(["string", "integer", "boolean"])}
+    return properties
+
+
+def make_document(rng, properties):
+    """Build a document which uses most, but not all, of the schema properties."""
+    document = {}
+    for name, prop_schema in properties.items():
+        if rng.random() < 0.2:
+            continue
+        if "properties" in prop_schema:
+            document[name] = make_document(rng, prop_schema["properties"])
+        elif "items" in prop_schema:
+            document[name] = [make_document(rng, prop_schema["items"]["properties"]) for _ in range(2)]
+        else:
+            document[name] = {"string": "value", "integer": 1, "boolean": True}[prop_schema["type"]]
+
+    # Add a few properties the schema does not define
+    for i in range(rng.randint(0, 2)):
+        document[f"extra{i}"] = "value"
+    return document
+
+
+def generate_corpus(root, documents, schemas, fan_out, depth, large_fraction, large_size, seed):
+    """
+    Generate a synthetic corpus laid out like the real pipeline: schemas/,
+    more_fetched_data/ and fetched_data/, plus the commits, licenses and
+    languages files used when splitting.
+    """
+    rng = random.Random(seed)
+    root = Path(root)
+
+    schema_urls = []
+    schema_properties = []
+    os.makedirs(root / "schemas", exist_ok=True)
+    for i in range(schemas):
+        url = f"https://example.com/schemas/schema{i}.json"
+        schema = {
+            "$schema": SCHEMA_DRAFT,
+            "$id": url,
+            "type": "object",
+            "properties": make_schema_properties(rng, fan_out, depth, "prop"),
+        }
+        with open(root / "schemas" / encode_url(url), "w") as f:
+            json.dump(schema, f)
+        schema_urls.append(url)
+        schema_properties.append(schema["properties"])
+
+    repositories = [f"owner{i}/repo{i}" for i in range(max(1, documents // 10))]
+    for i in range(documents):
+        schema_index = rng.randrange(schemas)
+        document = make_document(rng, schema_properties[schema_index])
+        document["$schema"] = schema_urls[schema_index]
+        if rng.random() < large_fraction:
+            document["payload"] = [{"value": "x" * 64} for _ in range(large_size // 80)]
+
+        path = root / "more_fetched_data" / repositories[i % len(repositories)] / f"{i:040x}" / "config.json"
+        os.makedirs(path.parent, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(document, f)
+
+    # Fetched schemas, one commit per schema version
+    commits = []
+    for i, (url, properties) in enumerate(zip(schema_urls, schema_properties)):
+        repository = repositories[i % len(repositories)]
+        sha = f"{i:040x}"
+        path = root / "fetched_data" / repository / sha / "schema.json"
+        os.makedirs(path.parent, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"$schema": SCHEMA_DRAFT, "$id": url, "type": "object", "properties": properties}, f)
+        commits.append({
+            "repository": repository,
+            "path": "schema.json",
+            "repoStars": "1",
+            "repoLastFetched": "2024-01-01T00:00:00Z",
+            "commits": [{"sha": sha, "date": "2024-01-01T00:00:00Z"}],
+        })
+
+    with open(root / "commits.json", "w") as f:
+        for obj in commits:
+            f.write(json.dumps(obj) + "\n")
+    with open(root / "licenses.json", "w") as f:
+        for repository in repositories:
+            f.write(json.dumps({"repository": repository, "license": "MIT"}) + "\n")
+    with open(root / "languages.json", "w") as f:
+        for repository in repositories:
+            f.write(json.dumps({"repository": repository, "language": "en"}) + "\n")
+    with open(root / "permissive_licenses.json", "w") as f:
+        json.dump(["MIT"], f)
+    os.makedirs(root / "data", exist_ok=True)
+
+
+def run_enumeration():
+    import compare_doc_schema
+    return len(list(compare_doc_schema.iter_innermost_json_files("more_fetched_data")))
+
+
+def run_tag_extraction():
+    import compare_doc_schema
+    files = compare_doc_schema.get_innermost_json_files("more_fetched_data")
+    for file_path in files:
+        try:
+            compare_doc_schema.scan_top_level_properties(file_path)
+        except ValueError:
+            pass
+    return len(files)
+
+
+def run_difference_analysis():
+    import compare_doc_schema
+    files = compare_doc_schema.get_innermost_json_files("more_fetched_data")
+    schema_registry = compare_doc_schema.SchemaRegistry("schemas")
+    document_facts = compare_doc_schema.collect_document_facts(files, schema_registry)
+    compare_doc_schema.find_top_level_properties_difference(document_facts)
+    return len(files)
+
+
+def run_validation():
+    import validate_schemas
+    files = list(Path("fetched_data").rglob("*.json"))
+    validate_schemas.validate_schemas(files)
+    return len(files)
+
+
+def run_splitting():
+    # train_split reads permissive_licenses.json on import
+    import train_split
+    files = list(Path("valid_data").rglob("*.json"))
+    train_split.main(None, 0.8, 38, "commits.json", "licenses.json", "languages.json")
+    return len(files)
+
+
+def _run_stage(stage, workdir, repo_dir, connection):
+    """Run a stage in a fresh process so peak RSS is measured per stage."""
+    os.chdir(workdir)
+    sys.path.insert(0, repo_dir)
+
+    # Keep the pipeline's own output out of the benchmark report
+    devnull = open(os.devnull, "w")
+    sys.stdout = devnull
+    sys.stderr = devnull
+
+    importlib.import_module(STAGE_MODULES[stage])
+    start = time.perf_counter()
+    files = globals()["run_" + stage]()
+    seconds = time.perf_counter() - start
+
+    # ru_maxrss is reported in kilobytes on Linux. For the children it is
+    # the peak of the largest worker the stage started and waited for.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    peak_child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    connection.send({
+        "seconds": seconds,
+        "files": files,
+        "peak_rss_bytes": max(peak_rss, peak_child_rss),
+        "peak_parent_rss_bytes": peak_rss,
+        "peak_child_rss_bytes": peak_child_rss,
+    })
+    connection.close()
+
+
+def run_stage(stage, workdir):
+    context = multiprocessing.get_context("spawn")
+    parent_connection, child_connection = context.Pipe(duplex=False)
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    process = context.Process(target=_run_stage, args=(stage, workdir, repo_dir, child_connection))
+    process.start()
+    child_connection.close()
+    try:
+        result = parent_connection.recv()
+    except EOFError:
+        result = None
+    process.join()
+
+    if result is None:
+        return {"error": f"stage exited with code {process.exitcode}"}
+    result["files_per_second"] = result["files"] / result["seconds"] if result["seconds"] > 0 else None
+    return result
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    parameters = {
+        "documents": args.documents,
+        "schemas": args.schemas,
+        "fan_out": args.fan_out,
+        "depth": args.depth,
+        "large_fraction": args.large_fraction,
+        "large_size": args.large_size,
+        "seed": args.seed,
+    }
+
+    # Files left by an earlier run, such as the validation cache, would be timed as hits
+    if args.workdir and os.path.isdir(args.workdir) and os.listdir(args.workdir):
+        sys.exit(f"Work directory '{args.workdir}' is not empty")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = os.path.abspath(args.workdir or tmpdir)
+        sys.stderr.write(f"Generating corpus in {workdir}…\n")
+        generate_corpus(workdir, **parameters)
+
+        results = {}
+        for stage in args.stages:
+            sys.stderr.write(f"Running {stage}…\n")
+            results[stage] = run_stage(stage, workdir)
+
+    report = {
+        "commit": get_commit(),
+        "python": sys.version.split()[0],
+        "parameters": parameters,
+        "stages": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", default=1000, type=int)
+    parser.add_argument("--schemas", default=50, type=int)
+    parser.add_argument("--fan_out", default=10, type=int)
+    parser.add_argument("--depth", default=3, type=int)
+    parser.add_argument("--large_fraction", default=0.01, type=float)
+    parser.add_argument("--large_size", default=1 << 20, type=int)
+    parser.add_argument("--seed", default=38, type=int)
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("--workdir", default=None,
+                        help="generate the corpus in this new or empty folder instead of a temporary one")
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    main(parser.parse_args())
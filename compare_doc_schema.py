@@ -1,14 +1,22 @@
+import argparse
+import cProfile
+import hashlib
 import json
 import os
 import csv
+import time
 import pandas as pd
-import matplotlib.pyplot as plt
-from collections import Counter
+from collections import Counter, OrderedDict
 import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+from scipy.signal import fftconvolve
 from scipy.stats import gaussian_kde
+from tqdm.contrib.concurrent import process_map
 
-# If not already imported, import seaborn for the heatmap
-import seaborn as sns
+import plotting
+from json_parsing import load_json
+from metrics import metrics, write_metrics
+from scan_json import scan_top_level_properties
 
 schema_keywords = {
     '$schema', '$id', '$ref', '$defs', '$comment', '$anchor',
@@ -20,9 +28,8 @@ schema_keywords = {
 def load_json_file(file_path):
     """Load a JSON file and return its content."""
     if file_path:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            return data
+        data, _ = load_json(file_path)
+        return data
 
 '''
 ---------------------
@@ -63,6 +70,37 @@ def get_arrays_of_objects_with_properties(schema, top_level_properties, objects_
                 arrays_properties_dict[prop] = child_props
     return arrays_properties_dict
 
+def compile_property_tree(schema):
+    """
+    Compile a schema into a tree of the properties it defines. Each node maps
+    property names to child nodes and holds a node for array items, so
+    documents can be compared against the schema at any depth.
+    """
+    root = {'properties': {}, 'items': None}
+    stack = [(schema, root)]
+    while stack:
+        subschema, node = stack.pop()
+
+        properties = subschema.get('properties')
+        if isinstance(properties, dict):
+            for prop, prop_schema in properties.items():
+                if prop in schema_keywords:
+                    continue
+                child = {'properties': {}, 'items': None}
+                node['properties'][prop] = child
+                if isinstance(prop_schema, dict):
+                    stack.append((prop_schema, child))
+
+        items = subschema.get('items')
+        if isinstance(items, dict):
+            node['items'] = {'properties': {}, 'items': None}
+            stack.append((items, node['items']))
+
+    return root
+
+def _escape_pointer_token(token):
+    return token.replace('~', '~0').replace('/', '~1')
+
 '''
 ------------------------------
 Reference JSON Files Functions
@@ -89,10 +127,39 @@ Read the innermost JSON files
 -----------------------------
 '''
 
-def get_innermost_json_files(root_folder, max_folders=None):
-    innermost_files = []
-    all_subdirs = [name for name in os.listdir(root_folder) if os.path.isdir(os.path.join(root_folder, name))]
-    all_subdirs.sort()
+def parse_shard(value):
+    """Parse a shard given as 'i/N' into (i, N)."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected i/N")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected 0 <= i < N")
+    return index, count
+
+def get_shard_index(repository, shard_count):
+    """Assign a repository folder to a shard using a hash which is stable across machines."""
+    digest = hashlib.md5(repository.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
+
+def _iter_json_files(folder_path):
+    with os.scandir(folder_path) as entries:
+        entries = list(entries)
+    for entry in entries:
+        if entry.is_dir():
+            if not entry.is_symlink():
+                yield from _iter_json_files(entry.path)
+        elif entry.name.endswith('.json'):
+            yield entry.path
+
+def iter_innermost_json_files(root_folder, max_folders=None, shard=None):
+    """
+    Yield the JSON files under root_folder while walking it. With shard=(i, N)
+    only the repositories (owner/repo folders) hashed to shard i are walked,
+    so N machines can each take a disjoint slice of the corpus.
+    """
+    with os.scandir(root_folder) as entries:
+        all_subdirs = sorted(entry.name for entry in entries if entry.is_dir())
 
     if max_folders is not None:
         target_folders = all_subdirs[:max_folders]
@@ -101,12 +168,63 @@ def get_innermost_json_files(root_folder, max_folders=None):
 
     for target_folder in target_folders:
         folder_path = os.path.join(root_folder, target_folder)
-        for dirpath, _, filenames in os.walk(folder_path):
-            json_files = [f for f in filenames if f.endswith('.json')]
-            for json_file in json_files:
-                innermost_files.append(os.path.join(dirpath, json_file))
+        if shard is None:
+            yield from _iter_json_files(folder_path)
+            continue
+
+        with os.scandir(folder_path) as entries:
+            entries = list(entries)
+        for entry in entries:
+            repository = f'{target_folder}/{entry.name}' if entry.is_dir() else target_folder
+            if get_shard_index(repository, shard[1]) != shard[0]:
+                continue
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    yield from _iter_json_files(entry.path)
+            elif entry.name.endswith('.json'):
+                yield entry.path
+
+def get_innermost_json_files(root_folder, max_folders=None, shard=None):
+    return list(iter_innermost_json_files(root_folder, max_folders=max_folders, shard=shard))
+
+def write_manifest(file_paths, manifest_file):
+    """Write the enumerated files to a manifest, one path per line, and yield them."""
+    with open(manifest_file + '.tmp', 'w', encoding='utf-8') as manifest:
+        for file_path in file_paths:
+            manifest.write(file_path + '\n')
+            yield file_path
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+def read_manifest(manifest_file, root_folder, shard=None):
+    """Yield the files listed in a manifest, keeping only those in the given shard."""
+    with open(manifest_file, 'r', encoding='utf-8') as manifest:
+        for line in manifest:
+            file_path = line.rstrip('\n')
+            if shard is not None:
+                parts = os.path.relpath(file_path, root_folder).split(os.sep)
+                repository = '/'.join(parts[:2]) if len(parts) > 2 else parts[0]
+                if get_shard_index(repository, shard[1]) != shard[0]:
+                    continue
+            yield file_path
+
+def iter_json_files_with_manifest(root_folder, manifest_file, max_folders=None, shard=None):
+    """
+    Yield the files to analyze, reading them from the manifest if it exists
+    and writing it while walking root_folder otherwise. The manifest always
+    lists every file, so a manifest first written for one shard can be
+    reused for the others.
+    """
+    if not os.path.isfile(manifest_file):
+        file_paths = write_manifest(iter_innermost_json_files(root_folder, max_folders=max_folders), manifest_file)
+        if shard is None:
+            yield from file_paths
+            return
+
+        # The whole tree is walked before the shard is taken from the manifest
+        for _ in file_paths:
+            pass
 
-    return innermost_files
+    yield from read_manifest(manifest_file, root_folder, shard=shard)
 
 def extract_schema_tag(file_path):
     with open(file_path, 'r') as file:
@@ -139,15 +257,336 @@ def get_schema_file_path(schema_url, schemas_folder):
         # Return None instead of raising an error
         return None
 
+def hash_file(file_path, chunk_size=1 << 16):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class SchemaRegistry:
+    """
+    Resolve $schema URLs against the schemas folder.
+
+    The folder is listed once when the registry is created. Top-level property
+    sets are kept for every schema that has been resolved, while parsed schemas
+    are held in a bounded LRU so memory stays flat on large corpora.
+    """
+
+    def __init__(self, schemas_folder, max_cached_schemas=128):
+        self.schemas_folder = schemas_folder
+        self.max_cached_schemas = max_cached_schemas
+        self._schema_files = {
+            filename for filename in os.listdir(schemas_folder)
+            if filename.endswith('.json') and os.path.isfile(os.path.join(schemas_folder, filename))
+        }
+        self._schemas = OrderedDict()
+        self._top_level_properties = {}
+        self._property_trees = {}
+        self._schema_hashes = {}
+        self._failures = {}
+
+    def get_schema_file_path(self, schema_url):
+        encoded_schema = encode_url(schema_url)
+        if encoded_schema in self._schema_files:
+            return os.path.join(self.schemas_folder, encoded_schema)
+        return None
+
+    def get_schema_hash(self, schema_url):
+        """Return the content hash of a schema file or None if it was not fetched."""
+        encoded_schema = encode_url(schema_url)
+        if encoded_schema not in self._schema_files:
+            return None
+
+        if encoded_schema not in self._schema_hashes:
+            self._schema_hashes[encoded_schema] = hash_file(os.path.join(self.schemas_folder, encoded_schema))
+        return self._schema_hashes[encoded_schema]
+
+    def get_schema(self, schema_url):
+        """Return the parsed schema for a URL or None if it was not fetched."""
+        encoded_schema = encode_url(schema_url)
+        if encoded_schema not in self._schema_files:
+            return None
+
+        if encoded_schema in self._schemas:
+            self._schemas.move_to_end(encoded_schema)
+            return self._schemas[encoded_schema]
+
+        # Do not retry schemas which failed to load before. Only the error
+        # type and arguments are kept since a cached exception object would
+        # collect another traceback every time it is raised.
+        if encoded_schema in self._failures:
+            error_class, args = self._failures[encoded_schema]
+            error = error_class.__new__(error_class)
+            error.args = args
+            raise error
+
+        try:
+            schema = load_json_file(os.path.join(self.schemas_folder, encoded_schema))
+        except Exception as e:
+            self._failures[encoded_schema] = (type(e), e.args)
+            raise
+
+        self._schemas[encoded_schema] = schema
+        if len(self._schemas) > self.max_cached_schemas:
+            self._schemas.popitem(last=False)
+
+        return schema
+
+    def get_top_level_properties(self, schema_url):
+        """Return the top-level properties of a schema or None if it is unavailable."""
+        encoded_schema = encode_url(schema_url)
+        if encoded_schema in self._top_level_properties:
+            return self._top_level_properties[encoded_schema]
+
+        schema = self.get_schema(schema_url)
+        if not schema:
+            properties = None
+        else:
+            properties = frozenset(extract_top_level_properties(schema))
+
+        if encoded_schema in self._schema_files:
+            self._top_level_properties[encoded_schema] = properties
+        return properties
+
+    def get_property_tree(self, schema_url):
+        """Return the compiled property tree of a schema or None if it is unavailable."""
+        encoded_schema = encode_url(schema_url)
+        if encoded_schema in self._property_trees:
+            return self._property_trees[encoded_schema]
+
+        schema = self.get_schema(schema_url)
+        tree = compile_property_tree(schema) if isinstance(schema, dict) and schema else None
+
+        if encoded_schema in self._schema_files:
+            self._property_trees[encoded_schema] = tree
+        return tree
+
+"""
+-----------------------
+Per-document fact table
+-----------------------
+"""
+
+def read_top_level_properties(file_path):
+    """Fully parse a document and return its top-level keys and $schema string."""
+    document = load_json_file(file_path)
+
+    # Documents which are not objects have no top-level properties
+    if not isinstance(document, dict):
+        return None, None
+
+    schema_tag = document.get('$schema')
+    return set(document.keys()), schema_tag if isinstance(schema_tag, str) else None
+
+def extract_document_fact(file_path, schema_registry, scan_keys=False, diff=True):
+    """
+    Parse a document once and collect everything the analyses need from it:
+    the $schema tag, the top-level keys and the missing/extra properties
+    against the referenced schema. With scan_keys large documents are
+    scanned for their top-level keys without building nested values.
+    Without diff the missing/extra properties are left for
+    count_top_level_properties_difference_bitset to count.
+
+    The status records why a document was skipped: decode_error,
+    read_error, not_an_object, no_schema_tag, schema_not_found,
+    empty_schema or schema_error. Compared documents have the status ok.
+    """
+    fact = {
+        'path': file_path,
+        'schema': None,
+        'properties': None,
+        'missing_properties': None,
+        'extra_properties': None,
+        'missing_count': None,
+        'extra_count': None,
+        'error': '',
+        'status': 'ok',
+        'size': None,
+        'mtime': None,
+        'content_hash': None,
+        'schema_hash': None,
+    }
+
+    try:
+        with metrics.stage('parse'):
+            if scan_keys:
+                properties, schema_tag = scan_top_level_properties(file_path)
+            else:
+                properties, schema_tag = read_top_level_properties(file_path)
+    except Exception as e:
+        fact['error'] = type(e).__name__
+        fact['status'] = 'decode_error' if isinstance(e, ValueError) else 'read_error'
+        return fact
+
+    fact['properties'] = properties
+    if properties is None:
+        fact['status'] = 'not_an_object'
+        return fact
+    if not schema_tag:
+        fact['status'] = 'no_schema_tag'
+        return fact
+    fact['schema'] = schema_tag
+
+    try:
+        with metrics.stage('schema_lookup'):
+            schema_top_level_props = schema_registry.get_top_level_properties(schema_tag)
+    except Exception as e:
+        fact['error'] = type(e).__name__
+        fact['status'] = 'schema_error'
+        return fact
+    if schema_top_level_props is None:
+        if schema_registry.get_schema_file_path(schema_tag) is None:
+            fact['status'] = 'schema_not_found'
+        else:
+            fact['status'] = 'empty_schema'
+        return fact
+    if not diff:
+        return fact
+
+    with metrics.stage('diff'):
+        # Exclude schema keywords from reference properties
+        filtered_reference_props = fact['properties'] - schema_keywords
+        fact['missing_properties'] = schema_top_level_props - filtered_reference_props
+        fact['extra_properties'] = filtered_reference_props - schema_top_level_props
+        fact['missing_count'] = len(fact['missing_properties'])
+        fact['extra_count'] = len(fact['extra_properties'])
+
+    return fact
+
+def _reuse_cached_fact(cached_fact, size, mtime, file_path, schema_registry, diff=True):
+    """
+    Return the cached fact for a file if neither the file nor its referenced
+    schema changed. Files whose size or mtime changed are hashed to check if
+    their content is still the same. Facts cached without their differences
+    are not reused when the differences are needed.
+    """
+    if cached_fact is None or cached_fact['content_hash'] is None:
+        return None
+    if diff and cached_fact['status'] == 'ok' and cached_fact['missing_properties'] is None:
+        return None
+
+    if cached_fact['size'] != size or cached_fact['mtime'] != mtime:
+        if cached_fact['size'] != size or hash_file(file_path) != cached_fact['content_hash']:
+            return None
+
+    if cached_fact['schema'] and schema_registry.get_schema_hash(cached_fact['schema']) != cached_fact['schema_hash']:
+        return None
+
+    return dict(cached_fact, size=size, mtime=mtime)
+
+def collect_document_facts(innermost_json_files, schema_registry, scan_keys=False, cached_facts=None, diff=True):
+    """
+    Extract the facts for every document. When cached_facts (a dict keyed by
+    path) is given, unchanged documents reuse their cached facts and new facts
+    record the file size, mtime and content hash along with the hash of the
+    referenced schema so a later run can reuse them.
+    """
+    if cached_facts is None:
+        return [
+            extract_document_fact(file_path, schema_registry, scan_keys, diff)
+            for file_path in innermost_json_files
+        ]
+
+    document_facts = []
+    for file_path in innermost_json_files:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            document_facts.append(extract_document_fact(file_path, schema_registry, scan_keys, diff))
+            continue
+
+        fact = _reuse_cached_fact(cached_facts.get(file_path), stat.st_size, stat.st_mtime_ns,
+                                  file_path, schema_registry, diff)
+        if fact is None:
+            fact = extract_document_fact(file_path, schema_registry, scan_keys, diff)
+            fact['size'] = stat.st_size
+            fact['mtime'] = stat.st_mtime_ns
+            fact['content_hash'] = hash_file(file_path)
+            if fact['schema']:
+                fact['schema_hash'] = schema_registry.get_schema_hash(fact['schema'])
+        document_facts.append(fact)
+
+    return document_facts
+
+def _encode_property_set(properties):
+    if properties is None:
+        return ''
+    return json.dumps(sorted(properties))
+
+def _decode_property_set(value):
+    if value == '':
+        return None
+    return set(json.loads(value))
+
+def _decode_optional_int(value):
+    return int(value) if value else None
+
+def write_document_facts(document_facts, output_csv='document_facts.csv'):
+    """Write the per-document facts table so later runs can skip parsing."""
+    with metrics.stage('write', 0), open(output_csv, 'w', newline='', encoding='utf-8') as csvfile:
+        fieldnames = ['Path', 'Schema', 'Properties', 'Missing', 'Extra', 'MissingCount', 'ExtraCount',
+                      'Error', 'Status', 'Size', 'Mtime', 'Hash', 'SchemaHash']
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+
+        for fact in document_facts:
+            writer.writerow({
+                'Path': fact['path'],
+                'Schema': fact['schema'] or '',
+                'Properties': _encode_property_set(fact['properties']),
+                'Missing': _encode_property_set(fact['missing_properties']),
+                'Extra': _encode_property_set(fact['extra_properties']),
+                'MissingCount': '' if fact['missing_count'] is None else fact['missing_count'],
+                'ExtraCount': '' if fact['extra_count'] is None else fact['extra_count'],
+                'Error': fact['error'],
+                'Status': fact['status'],
+                'Size': '' if fact['size'] is None else fact['size'],
+                'Mtime': '' if fact['mtime'] is None else fact['mtime'],
+                'Hash': fact['content_hash'] or '',
+                'SchemaHash': fact['schema_hash'] or '',
+            })
+
+    print(f"Facts for {len(document_facts)} documents have been written to '{output_csv}'")
+
+def load_document_facts(input_csv='document_facts.csv'):
+    document_facts = []
+    with open(input_csv, 'r', newline='', encoding='utf-8') as csvfile:
+        for row in csv.DictReader(csvfile):
+            fact = {
+                'path': row['Path'],
+                'schema': row['Schema'] or None,
+                'properties': _decode_property_set(row['Properties']),
+                'missing_properties': _decode_property_set(row['Missing']),
+                'extra_properties': _decode_property_set(row['Extra']),
+                'missing_count': _decode_optional_int(row.get('MissingCount')),
+                'extra_count': _decode_optional_int(row.get('ExtraCount')),
+                'error': row['Error'],
+                'status': row.get('Status') or '',
+                'size': _decode_optional_int(row.get('Size')),
+                'mtime': _decode_optional_int(row.get('Mtime')),
+                'content_hash': row.get('Hash') or None,
+                'schema_hash': row.get('SchemaHash') or None,
+            }
+
+            # Tables written before the counts were recorded
+            for kind in ('missing', 'extra'):
+                if fact[kind + '_count'] is None and fact[kind + '_properties'] is not None:
+                    fact[kind + '_count'] = len(fact[kind + '_properties'])
+            document_facts.append(fact)
+
+    return document_facts
+
 """
 ----------------------
 Get Missing and Extra Properties
 ----------------------
 """
 
-def find_top_level_properties_difference(innermost_json_files, schemas_folder):
+def count_top_level_properties_difference(document_facts):
     """
-    Find missing and extra top-level properties and write the results to CSV files.
+    Count missing and extra top-level properties per schema. The returned
+    counters can be merged with merge_top_level_properties_differences.
     """
     errors = 0
 
@@ -158,186 +597,405 @@ def find_top_level_properties_difference(innermost_json_files, schemas_folder):
     }
     schema_file_counts = {}
 
-    for file_path in innermost_json_files:
-        try:
-            schema_tag = extract_schema_tag(file_path)
-            if not schema_tag or schema_tag == "No $schema tag found":
-                # print(f"File: {file_path}")
-                # print("Error: No $schema tag found.\n")
-                continue
+    for fact in document_facts:
+        if fact['error']:
+            errors += 1
+            continue
 
-            schema_file_path = get_schema_file_path(schema_tag, schemas_folder)
-            if not schema_file_path:
-                continue
+        schema_tag = fact['schema']
+        missing_props = fact['missing_properties']
+        extra_props = fact['extra_properties']
+        if missing_props is None or extra_props is None:
+            continue
 
-            schema = load_json_file(schema_file_path)
-            reference_document = load_json_file(file_path)
+        # Update schema file counts
+        if schema_tag not in schema_file_counts:
+            schema_file_counts[schema_tag] = 0
+        schema_file_counts[schema_tag] += 1
+
+        # Update counts for missing properties
+        if schema_tag not in differences['missing']:
+            differences['missing'][schema_tag] = {}
+        for prop in sorted(missing_props):
+            differences['missing'][schema_tag][prop] = differences['missing'][schema_tag].get(prop, 0) + 1
+
+        # Update counts for extra properties
+        if schema_tag not in differences['extra']:
+            differences['extra'][schema_tag] = {}
+        for prop in sorted(extra_props):
+            differences['extra'][schema_tag][prop] = differences['extra'][schema_tag].get(prop, 0) + 1
+
+    sort_properties(differences)
+    return differences, schema_file_counts, errors
+
+class PropertyVocabulary:
+    """Intern property names into dense integer IDs."""
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def intern(self, name):
+        prop_id = self.ids.get(name)
+        if prop_id is None:
+            prop_id = len(self.names)
+            self.ids[name] = prop_id
+            self.names.append(name)
+        return prop_id
+
+    def intern_all(self, names):
+        """Intern a sequence of names with one dictionary lookup pass."""
+        prop_ids = list(map(self.ids.get, names))
+        if None in prop_ids:
+            prop_ids = [self.intern(name) for name in names]
+        return np.array(prop_ids, dtype=np.int64)
+
+def count_top_level_properties_difference_bitset(document_facts, schema_registry, vocabulary=None):
+    """
+    Vectorized version of count_top_level_properties_difference for facts
+    extracted without diff. The keys of all documents of a schema are
+    interned in one pass and looked up in a membership array of the schema's
+    properties, so missing and extra counts come from bincounts instead of
+    per-document set operations. The per-document missing and extra counts
+    are filled into the facts.
+    """
+    if vocabulary is None:
+        vocabulary = PropertyVocabulary()
+    keyword_ids = vocabulary.intern_all(sorted(schema_keywords))
+    errors = 0
 
-            if not schema or not reference_document:
-                continue
+    facts_by_schema = {}
+    for fact in document_facts:
+        if fact['error']:
+            errors += 1
+            continue
+        if fact['status'] != 'ok':
+            continue
+        facts_by_schema.setdefault(fact['schema'], []).append(fact)
 
-            schema_top_level_props = extract_top_level_properties(schema)
-            reference_top_level_props = extract_reference_properties(reference_document)
+    differences = {
+        'missing': {},
+        'extra': {}
+    }
+    schema_file_counts = {}
 
-            # Exclude schema keywords from reference properties
-            filtered_reference_props = reference_top_level_props - schema_keywords
+    for schema_tag, facts in facts_by_schema.items():
+        schema_top_level_props = schema_registry.get_top_level_properties(schema_tag)
+        if schema_top_level_props is None:
+            continue
 
-            # Find missing and extra properties
-            missing_props = schema_top_level_props - filtered_reference_props
-            extra_props = filtered_reference_props - schema_top_level_props
+        schema_ids = vocabulary.intern_all(schema_top_level_props)
+        lengths = [len(fact['properties']) for fact in facts]
+        prop_ids = vocabulary.intern_all([prop for fact in facts for prop in fact['properties']])
+        rows = np.repeat(np.arange(len(facts)), lengths)
+
+        # Schema keywords in documents are neither missing nor extra
+        is_keyword = np.zeros(len(vocabulary.names), dtype=bool)
+        is_keyword[keyword_ids] = True
+        in_schema = np.zeros(len(vocabulary.names), dtype=bool)
+        in_schema[schema_ids] = True
+        counted = ~is_keyword[prop_ids]
+        present = in_schema[prop_ids] & counted
+        extra = ~in_schema[prop_ids] & counted
+
+        size = len(vocabulary.names)
+        missing_counts = len(facts) - np.bincount(prop_ids[present], minlength=size)
+        missing_counts[~in_schema] = 0
+        extra_counts = np.bincount(prop_ids[extra], minlength=size)
+
+        document_missing = len(schema_ids) - np.bincount(rows[present], minlength=len(facts))
+        document_extra = np.bincount(rows[extra], minlength=len(facts))
+        for fact, missing_count, extra_count in zip(facts, document_missing.tolist(), document_extra.tolist()):
+            fact['missing_count'] = missing_count
+            fact['extra_count'] = extra_count
+
+        schema_file_counts[schema_tag] = len(facts)
+        for difference_type, counts in [('missing', missing_counts), ('extra', extra_counts)]:
+            props_counts = {vocabulary.names[i]: int(counts[i]) for i in np.flatnonzero(counts)}
+            differences[difference_type][schema_tag] = dict(sorted(props_counts.items()))
+
+    return differences, schema_file_counts, errors
+
+def merge_top_level_properties_differences(partial_results):
+    """
+    Reduce partial counters into a single result. Partials are merged in
+    order and properties sorted so the output matches a serial run over the
+    same files.
+    """
+    errors = 0
+    differences = {
+        'missing': {},
+        'extra': {}
+    }
+    schema_file_counts = {}
 
-            # Update schema file counts
-            if schema_tag not in schema_file_counts:
-                schema_file_counts[schema_tag] = 0
-            schema_file_counts[schema_tag] += 1
+    for partial_differences, partial_file_counts, partial_errors in partial_results:
+        errors += partial_errors
 
-            # Update counts for missing properties
-            if schema_tag not in differences['missing']:
-                differences['missing'][schema_tag] = {}
-            for prop in missing_props:
-                differences['missing'][schema_tag][prop] = differences['missing'][schema_tag].get(prop, 0) + 1
+        for schema_tag, count in partial_file_counts.items():
+            schema_file_counts[schema_tag] = schema_file_counts.get(schema_tag, 0) + count
 
-            # Update counts for extra properties
-            if schema_tag not in differences['extra']:
-                differences['extra'][schema_tag] = {}
-            for prop in extra_props:
-                differences['extra'][schema_tag][prop] = differences['extra'][schema_tag].get(prop, 0) + 1
+        for difference_type in ['missing', 'extra']:
+            for schema_tag, props_counts in partial_differences[difference_type].items():
+                merged_counts = differences[difference_type].setdefault(schema_tag, {})
+                for prop, count in props_counts.items():
+                    merged_counts[prop] = merged_counts.get(prop, 0) + count
+
+    sort_properties(differences)
+    return differences, schema_file_counts, errors
+
+def sort_properties(differences):
+    """Order each schema's properties by name so every counting mode writes the same files."""
+    for difference_type in ['missing', 'extra']:
+        for schema_tag, props_counts in differences[difference_type].items():
+            differences[difference_type][schema_tag] = dict(sorted(props_counts.items()))
+
+RESULT_KINDS = ('missing', 'extra')
+
+def write_top_level_properties_store(differences, schema_file_counts, output_file='top_level_properties.npz'):
+    """
+    Store the raw missing/extra counts and file totals as typed columns in a
+    compressed NumPy archive. Schema and property names are dictionary
+    encoded against sorted dictionaries.
+    """
+    rows = [
+        (schema_url, prop, kind, count, schema_file_counts[schema_url])
+        for kind, difference_type in enumerate(RESULT_KINDS)
+        for schema_url, props_counts in differences[difference_type].items()
+        for prop, count in props_counts.items()
+    ]
+
+    schema_dictionary = sorted({row[0] for row in rows})
+    property_dictionary = sorted({row[1] for row in rows})
+    schema_codes = {schema_url: code for code, schema_url in enumerate(schema_dictionary)}
+    property_codes = {prop: code for code, prop in enumerate(property_dictionary)}
+
+    np.savez_compressed(
+        output_file,
+        schema_dictionary=np.array(schema_dictionary, dtype=str),
+        property_dictionary=np.array(property_dictionary, dtype=str),
+        schema=np.array([schema_codes[row[0]] for row in rows], dtype=np.int32),
+        property=np.array([property_codes[row[1]] for row in rows], dtype=np.int32),
+        kind=np.array([row[2] for row in rows], dtype=np.int8),
+        count=np.array([row[3] for row in rows], dtype=np.int64),
+        total_files=np.array([row[4] for row in rows], dtype=np.int64),
+    )
 
+def load_top_level_properties_store(input_file='top_level_properties.npz'):
+    """Load the result store as a DataFrame with categorical string columns."""
+    with np.load(input_file) as store:
+        return pd.DataFrame({
+            'Schema': pd.Categorical.from_codes(store['schema'], categories=store['schema_dictionary']),
+            'Property': pd.Categorical.from_codes(store['property'], categories=store['property_dictionary']),
+            'Kind': pd.Categorical.from_codes(store['kind'], categories=list(RESULT_KINDS)),
+            'Count': store['count'],
+            'TotalFiles': store['total_files'],
+        })
+
+def export_top_level_properties_csv(results):
+    """Export the result store to the percentage CSV files used by earlier versions."""
+    for difference_type in RESULT_KINDS:
+        output_csv = f'{difference_type}_top_level_properties.csv'
+        with open(output_csv, 'w', newline='', encoding='utf-8') as csvfile:
+            fieldnames = ['Schema', 'Property', 'Percentage']
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+
+            rows = results[results['Kind'] == difference_type]
+            for schema_url, prop, count, total_files in zip(rows['Schema'], rows['Property'], rows['Count'], rows['TotalFiles']):
+                percentage = (count / total_files) * 100 if total_files > 0 else 0.0
+                writer.writerow({'Schema': schema_url, 'Property': prop, 'Percentage': f"{percentage:.2f}"})
+
+        print(f"{difference_type.capitalize()} top-level properties percentages have been written to '{output_csv}'")
+
+def write_top_level_properties_difference(differences, schema_file_counts, errors,
+                                          output_file='top_level_properties.npz'):
+    """Write the missing and extra top-level property counts to the result store and CSV files."""
+    print(f"{errors} errors found")
+    with metrics.stage('write', 0):
+        write_top_level_properties_store(differences, schema_file_counts, output_file)
+        print(f"Top-level property counts have been written to '{output_file}'")
+        export_top_level_properties_csv(load_top_level_properties_store(output_file))
+
+def find_top_level_properties_difference(document_facts, schema_registry=None, bitset=False):
+    """
+    Find missing and extra top-level properties and write the results to CSV files.
+    With bitset the counts are computed with count_top_level_properties_difference_bitset.
+    """
+    with metrics.stage('diff', 0):
+        if bitset:
+            differences, schema_file_counts, errors = count_top_level_properties_difference_bitset(
+                document_facts, schema_registry
+            )
+        else:
+            differences, schema_file_counts, errors = count_top_level_properties_difference(document_facts)
+    write_top_level_properties_difference(differences, schema_file_counts, errors)
+
+    return differences, schema_file_counts
+
+# Each worker process keeps its own registry so schemas are loaded once per process
+_worker_schema_registry = None
+
+def _process_document_chunk(args):
+    global _worker_schema_registry
+
+    file_paths, schemas_folder, scan_keys, cached_facts, bitset = args
+    if _worker_schema_registry is None or _worker_schema_registry.schemas_folder != schemas_folder:
+        _worker_schema_registry = SchemaRegistry(schemas_folder)
+
+    # Stage timings are sent back with the results and merged by the caller
+    metrics.reset()
+    document_facts = collect_document_facts(file_paths, _worker_schema_registry, scan_keys, cached_facts,
+                                            diff=not bitset)
+    with metrics.stage('diff', 0):
+        if bitset:
+            partial = count_top_level_properties_difference_bitset(document_facts, _worker_schema_registry)
+        else:
+            partial = count_top_level_properties_difference(document_facts)
+    return document_facts, partial, metrics.stages
+
+def find_top_level_properties_difference_parallel(innermost_json_files, schemas_folder, workers, chunk_size=500,
+                                                  scan_keys=False, cached_facts=None, bitset=False):
+    """
+    Parallel version of collect_document_facts followed by
+    find_top_level_properties_difference. Each worker handles a chunk of
+    files and returns its facts along with partial counters which are
+    reduced into the same CSV output as the serial path.
+    """
+    chunks = []
+    for i in range(0, len(innermost_json_files), chunk_size):
+        chunk_files = innermost_json_files[i:i + chunk_size]
+
+        # Only send each worker the cached facts for its own files
+        chunk_cache = None
+        if cached_facts is not None:
+            chunk_cache = {path: cached_facts[path] for path in chunk_files if path in cached_facts}
+        chunks.append((chunk_files, schemas_folder, scan_keys, chunk_cache, bitset))
+    results = process_map(_process_document_chunk, chunks, max_workers=workers, chunksize=1)
+
+    document_facts = []
+    for chunk_facts, _, chunk_stages in results:
+        document_facts.extend(chunk_facts)
+        metrics.merge(chunk_stages)
+
+    differences, schema_file_counts, errors = merge_top_level_properties_differences(
+        partial for _, partial, _ in results
+    )
+    write_top_level_properties_difference(differences, schema_file_counts, errors)
+
+    return document_facts, differences, schema_file_counts
+
+def find_nested_properties_difference_in_document(document, property_tree):
+    """
+    Walk a document against a compiled property tree in a single traversal.
+    Returns the JSON pointer paths of missing and extra properties, with the
+    elements of an array collapsed into a single '*' segment.
+    """
+    missing_paths = set()
+    extra_paths = set()
+
+    stack = [(document, property_tree, '')]
+    while stack:
+        value, node, path = stack.pop()
+
+        if isinstance(value, dict) and node['properties']:
+            schema_props = node['properties']
+            document_props = set(value.keys()) - schema_keywords
+
+            for prop in schema_props.keys() - document_props:
+                missing_paths.add(path + '/' + _escape_pointer_token(prop))
+            for prop in document_props - schema_props.keys():
+                extra_paths.add(path + '/' + _escape_pointer_token(prop))
+
+            for prop in document_props & schema_props.keys():
+                child = schema_props[prop]
+                if child['properties'] or child['items']:
+                    stack.append((value[prop], child, path + '/' + _escape_pointer_token(prop)))
+
+        elif isinstance(value, list) and node['items']:
+            item_path = path + '/*'
+            for item in value:
+                stack.append((item, node['items'], item_path))
+
+    return missing_paths, extra_paths
+
+def find_nested_properties_difference(document_facts, schema_registry):
+    """
+    Find missing and extra properties at any depth and write the results to
+    CSV files keyed by JSON pointer path. Only documents whose schema was
+    resolved during fact extraction are parsed again.
+    """
+    errors = 0
+
+    differences = {
+        'missing': {},
+        'extra': {}
+    }
+    schema_file_counts = {}
+
+    for fact in document_facts:
+        if fact['status'] != 'ok':
+            continue
+
+        schema_tag = fact['schema']
+        try:
+            property_tree = schema_registry.get_property_tree(schema_tag)
+            if property_tree is None:
+                continue
+
+            document = load_json_file(fact['path'])
+            missing_paths, extra_paths = find_nested_properties_difference_in_document(document, property_tree)
         except Exception as e:
             errors += 1
             continue
 
+        schema_file_counts[schema_tag] = schema_file_counts.get(schema_tag, 0) + 1
+
+        for difference_type, paths in [('missing', missing_paths), ('extra', extra_paths)]:
+            paths_counts = differences[difference_type].setdefault(schema_tag, {})
+            for path in sorted(paths):
+                paths_counts[path] = paths_counts.get(path, 0) + 1
+
     # Write the results to CSV files
     for difference_type in ['missing', 'extra']:
-        output_csv = f'{difference_type}_top_level_properties.csv'
+        output_csv = f'{difference_type}_nested_properties.csv'
         with open(output_csv, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['Schema', 'Property', 'Percentage']
+            fieldnames = ['Schema', 'Path', 'Percentage']
             writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
             writer.writeheader()
 
-            for schema_url, props_counts in differences[difference_type].items():
+            for schema_url, paths_counts in differences[difference_type].items():
                 total_files = schema_file_counts[schema_url]
-                for prop, count in props_counts.items():
+                for path, count in paths_counts.items():
                     percentage = (count / total_files) * 100 if total_files > 0 else 0.0
-                    writer.writerow({'Schema': schema_url, 'Property': prop, 'Percentage': f"{percentage:.2f}"})
+                    writer.writerow({'Schema': schema_url, 'Path': path, 'Percentage': f"{percentage:.2f}"})
 
         print(f"{errors} errors found")
-        print(f"{difference_type.capitalize()} top-level properties percentages have been written to '{output_csv}'")
+        print(f"{difference_type.capitalize()} nested properties percentages have been written to '{output_csv}'")
 
     return differences, schema_file_counts
 
-# def find_missing_nested_properties(innermost_json_files, schemas_folder):
-#     """Find missing nested properties and write the results to a CSV file."""
-#
-#     missing_nested_props_counts = {}
-#     schema_file_counts = {}
-#     schemaerror = 0
-#     fileerror = 0
-#     cantloaddoc = 0
-#     noprops = 0
-#     errors = 0
-#
-#     for file_path in innermost_json_files:
-#         try:
-#             # Extract the $schema tag
-#             schema_tag = extract_schema_tag(file_path)
-#             if not schema_tag or schema_tag == "No $schema tag found":
-#                 schemaerror += 1
-#                 continue
-#
-#             # Get the path of schema mentioned above
-#             schema_file_path = get_schema_file_path(schema_tag, schemas_folder)
-#             if not schema_file_path:
-#                 fileerror += 1
-#                 continue
-#
-#             # Load the schema and the reference document
-#             schema = load_json_file(schema_file_path)
-#             reference_document = load_json_file(file_path)
-#
-#             if not schema or not reference_document:
-#                 cantloaddoc += 1
-#                 continue
-#
-#             # Get nested properties from schema
-#             schema_top_level_props = extract_top_level_properties(schema)
-#             objects_with_properties, schema_nested_props_dict = extract_objects_with_properties(schema, schema_top_level_props)
-#
-#             if not objects_with_properties:
-#                 noprops += 1
-#                 continue  # No nested properties to compare
-#
-#             reference_nested_props_dict = extract_reference_child_properties(reference_document, objects_with_properties)
-#
-#             for obj_prop in objects_with_properties:
-#                 schema_nested_props = schema_nested_props_dict.get(obj_prop, set())
-#                 reference_nested_props = reference_nested_props_dict.get(obj_prop, set())
-#                 missing_nested_props = schema_nested_props - reference_nested_props
-#
-#                 if missing_nested_props:
-#                     if schema_tag not in missing_nested_props_counts:
-#                         missing_nested_props_counts[schema_tag] = {}
-#                     if schema_tag not in schema_file_counts:
-#                         schema_file_counts[schema_tag] = 0
-#                     schema_file_counts[schema_tag] += 1
-#
-#                     for nested_prop in missing_nested_props:
-#                         key = (obj_prop, nested_prop)
-#                         if key in missing_nested_props_counts[schema_tag]:
-#                             missing_nested_props_counts[schema_tag][key] += 1
-#                         else:
-#                             missing_nested_props_counts[schema_tag][key] = 1
-#
-#         except Exception as e:
-#             errors += 1
-#             continue
-#
-#     # Write the results to a CSV file
-#     output_csv = 'missing_nested_properties.csv'
-#
-#     with open(output_csv, 'w', newline='', encoding='utf-8') as csvfile:
-#         fieldnames = ['Schema', 'Parent_Property', 'Child_Property', 'Percentage']
-#         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-#
-#         writer.writeheader()
-#
-#         for schema_url, props_counts in missing_nested_props_counts.items():
-#             total_files = schema_file_counts.get(schema_url, 0)
-#             for (parent_prop, child_prop), count in props_counts.items():
-#                 percentage = (count / total_files) * 100 if total_files > 0 else 0.0
-#                 writer.writerow({
-#                     'Schema': schema_url,
-#                     'Parent_Property': parent_prop,
-#                     'Child_Property': child_prop,
-#                     'Percentage': f"{percentage:.2f}"
-#                 })
-#
-#     print(f"{len(innermost_json_files)} files processed, {noprops} with no child props, "
-#           f"{schemaerror} schema tag errors, {fileerror} can't load file errors, {cantloaddoc} can't load doc errors, {errors} errors")
-#     print(f"Missing nested properties percentages have been written to '{output_csv}'")
-
 """
 -------------------
 Analysis of results
 -------------------
 """
 
-def top_level_properties_analysis():
-    df = pd.read_csv('missing_top_level_properties.csv', header=0)
-    missing_grouped_properties = df[df['Percentage'].astype(float) > 50].groupby('Schema')['Property'].apply(list)
-    print("------MISSING PROPERTIES ANALYSIS------")
-    for counter, (schema, properties) in enumerate(missing_grouped_properties.items()):
-        print(f"{counter} -> {schema}")
-        print(", ".join(properties))
-        print()
-
-    df = pd.read_csv('extra_top_level_properties.csv', header=0)
-    extra_grouped_properties = df[df['Percentage'].astype(float) > 50].groupby('Schema')['Property'].apply(list)
-    print("------EXTRA PROPERTIES ANALYSIS------")
-    for counter, (schema, properties) in enumerate(extra_grouped_properties.items()):
-        print(f"{counter} -> {schema}")
-        print(", ".join(properties))
-        print()
+def top_level_properties_analysis(input_file='top_level_properties.npz', threshold=50):
+    results = load_top_level_properties_store(input_file)
+    results = results[results['Count'] / results['TotalFiles'] * 100 > threshold]
+
+    for difference_type in RESULT_KINDS:
+        grouped_properties = (
+            results[results['Kind'] == difference_type]
+            .groupby('Schema', observed=True)['Property']
+            .apply(list)
+        )
+        print(f"------{difference_type.upper()} PROPERTIES ANALYSIS------")
+        for counter, (schema, properties) in enumerate(grouped_properties.items()):
+            print(f"{counter} -> {schema}")
+            print(", ".join(properties))
+            print()
 
 """
 -----------------------------------------------
@@ -345,29 +1003,33 @@ Get frequency count of most used property names
 -----------------------------------------------
 """
 
-def count_top_level_properties(innermost_json_files):
+def count_top_level_properties(document_facts):
 
     property_counts = Counter()
     errors = 0
-    for file_path in innermost_json_files:
-        try:
-            data = load_json_file(file_path)
-            if not data:
-                continue
-
-            properties = set(data.keys())
-            properties = properties - schema_keywords
-            property_counts.update(properties)
-
-        except Exception as e:
+    for fact in document_facts:
+        if fact['error'] or fact['properties'] is None:
             errors += 1
             continue
 
+        properties = fact['properties'] - schema_keywords
+        property_counts.update(properties)
+
     top_5_properties = property_counts.most_common(5)
 
     # Separate the property names and counts
     properties = [prop for prop, count in top_5_properties]
     counts = [count for prop, count in top_5_properties]
+    plotting.render(_draw_top_properties, properties, counts)
+
+    # Print the top 5 properties with their counts
+    print("Top 5 most used properties:")
+    print(f"{errors} errors found")
+    for prop, count in top_5_properties:
+        print(f"{prop}: {count}")
+
+def _draw_top_properties(properties, counts):
+    plt = plotting.get_pyplot()
 
     # Plotting the horizontal bar graph
     plt.figure(figsize=(5, 2))
@@ -379,13 +1041,7 @@ def count_top_level_properties(innermost_json_files):
 
     plt.gca().invert_yaxis()  # Highest count on top
     plt.tight_layout()
-    plt.show()
-
-    # Print the top 5 properties with their counts
-    print("Top 5 most used properties:")
-    print(f"{errors} errors found")
-    for prop, count in top_5_properties:
-        print(f"{prop}: {count}")
+    plotting.show('top_properties')
 
 """
 ------------------------
@@ -412,21 +1068,14 @@ def collect_schema_property_counts(schemas_folder):
 
     return schema_property_counts
 
-def collect_document_property_counts(innermost_json_files):
+def collect_document_property_counts(document_facts):
     document_property_counts = []
-    errors = 0
-    for file_path in innermost_json_files:
-        try:
-            data = load_json_file(file_path)
-            if not data:
-                continue
-            properties = set(data.keys())
-            properties = properties - schema_keywords
-            num_properties = len(properties)
-            document_property_counts.append(num_properties)
-        except Exception as e:
-            errors += 1
+    for fact in document_facts:
+        if not fact['properties']:
             continue
+        properties = fact['properties'] - schema_keywords
+        num_properties = len(properties)
+        document_property_counts.append(num_properties)
 
     return document_property_counts
 
@@ -443,6 +1092,23 @@ def plot_property_count_histograms(schema_counts, document_counts):
     num_schemas_excluded = len(schema_counts_array) - len(filtered_schema_counts)
     print(f"Number of schemas excluded as outliers: {num_schemas_excluded}")
     print(f"IQR for schemas: Q1={Q1}, Q3={Q3}, IQR={IQR}, Lower Bound=0, Upper Bound={upper_bound}")
+    plotting.render(_draw_schema_property_count_histogram, filtered_schema_counts)
+
+    # Process documents
+    document_counts_array = np.array(document_counts)
+    Q1_doc = np.percentile(document_counts_array, 25)
+    Q3_doc = np.percentile(document_counts_array, 75)
+    IQR_doc = Q3_doc - Q1_doc
+    lower_bound_doc = Q1_doc - 1.5 * IQR_doc
+    upper_bound_doc = Q3_doc + 1.5 * IQR_doc
+    filtered_document_counts = document_counts_array[(document_counts_array >= lower_bound_doc) & (document_counts_array <= upper_bound_doc)]
+    num_documents_excluded = len(document_counts_array) - len(filtered_document_counts)
+    print(f"Number of documents excluded as outliers: {num_documents_excluded}")
+    print(f"IQR for documents: Q1={Q1_doc}, Q3={Q3_doc}, IQR={IQR_doc}, Lower Bound=0, Upper Bound={upper_bound_doc}")
+    plotting.render(_draw_document_property_count_histogram, filtered_document_counts)
+
+def _draw_schema_property_count_histogram(filtered_schema_counts):
+    plt = plotting.get_pyplot()
 
     # Plot histogram for schemas
     plt.figure(figsize=(10, 6))
@@ -465,19 +1131,10 @@ def plot_property_count_histograms(schema_counts, document_counts):
 
     plt.grid(axis='y', alpha=0.75)
     plt.tight_layout()
-    plt.show()
+    plotting.show('schema_property_counts_histogram')
 
-    # Process documents
-    document_counts_array = np.array(document_counts)
-    Q1_doc = np.percentile(document_counts_array, 25)
-    Q3_doc = np.percentile(document_counts_array, 75)
-    IQR_doc = Q3_doc - Q1_doc
-    lower_bound_doc = Q1_doc - 1.5 * IQR_doc
-    upper_bound_doc = Q3_doc + 1.5 * IQR_doc
-    filtered_document_counts = document_counts_array[(document_counts_array >= lower_bound_doc) & (document_counts_array <= upper_bound_doc)]
-    num_documents_excluded = len(document_counts_array) - len(filtered_document_counts)
-    print(f"Number of documents excluded as outliers: {num_documents_excluded}")
-    print(f"IQR for documents: Q1={Q1_doc}, Q3={Q3_doc}, IQR={IQR_doc}, Lower Bound=0, Upper Bound={upper_bound_doc}")
+def _draw_document_property_count_histogram(filtered_document_counts):
+    plt = plotting.get_pyplot()
 
     # Plot histogram for documents
     plt.figure(figsize=(10, 6))
@@ -488,60 +1145,48 @@ def plot_property_count_histograms(schema_counts, document_counts):
     plt.ylabel('Frequency')
     plt.grid(axis='y', alpha=0.75)
     plt.tight_layout()
-    plt.show()
+    plotting.show('document_property_counts_histogram')
 
 # --- Add the following four functions under this section ---
 
 def plot_property_count_boxplots(schema_counts, document_counts):
     # Box plot for schema counts
-    plt.figure(figsize=(6, 6))
-    plt.boxplot(schema_counts, showfliers=True)
-    plt.title("Box Plot of Property Counts in Schemas")
-    plt.ylabel('Number of Properties')
-    plt.grid(True)
-    plt.tight_layout()
-    plt.show()
+    plotting.render(_draw_boxplot, schema_counts, "Box Plot of Property Counts in Schemas",
+                    'Number of Properties', 'schema_property_counts_boxplot')
 
     # Box plot for document counts
+    plotting.render(_draw_boxplot, document_counts, "Box Plot of Property Counts in JSON Documents",
+                    'Number of Properties', 'document_property_counts_boxplot')
+
+def _draw_boxplot(counts, title, ylabel, name):
+    plt = plotting.get_pyplot()
+
     plt.figure(figsize=(6, 6))
-    plt.boxplot(document_counts, showfliers=True)
-    plt.title("Box Plot of Property Counts in JSON Documents")
-    plt.ylabel('Number of Properties')
+    plt.boxplot(counts, showfliers=True)
+    plt.title(title)
+    plt.ylabel(ylabel)
     plt.grid(True)
     plt.tight_layout()
-    plt.show()
+    plotting.show(name)
 
 
 
-def plot_missing_properties_histogram(innermost_json_files, schemas_folder):
-    missing_counts = []
-    for file_path in innermost_json_files:
-        try:
-            schema_tag = extract_schema_tag(file_path)
-            if not schema_tag or schema_tag == "No $schema tag found":
-                continue
-
-            schema_file_path = get_schema_file_path(schema_tag, schemas_folder)
-            if not schema_file_path:
-                continue
-
-            schema = load_json_file(schema_file_path)
-            reference_document = load_json_file(file_path)
-
-            if not schema or not reference_document:
-                continue
-
-            schema_props = extract_top_level_properties(schema)
-            doc_props = extract_reference_properties(reference_document) - schema_keywords
-            missing_props = schema_props - doc_props
-            missing_counts.append(len(missing_props))
-        except Exception as e:
-            continue
+def plot_missing_properties_histogram(document_facts):
+    missing_counts = [
+        fact['missing_count']
+        for fact in document_facts
+        if fact['missing_count'] is not None
+    ]
 
     if not missing_counts:
         print("No missing properties data available.")
         return
 
+    plotting.render(_draw_missing_properties_histogram, missing_counts)
+
+def _draw_missing_properties_histogram(missing_counts):
+    plt = plotting.get_pyplot()
+
     # Plotting
     plt.figure(figsize=(10, 6))
     plt.hist(missing_counts, bins=range(max(missing_counts) + 2), color='#FFA600', edgecolor='black', align='left')
@@ -551,35 +1196,16 @@ def plot_missing_properties_histogram(innermost_json_files, schemas_folder):
     plt.xticks(range(max(missing_counts) + 1))
     plt.grid(axis='y', alpha=0.75)
     plt.tight_layout()
-    plt.show()
+    plotting.show('missing_properties_histogram')
 
 
-def plot_extra_fields_boxplot(innermost_json_files, schemas_folder):
-    extra_counts = []
-
-    for file_path in innermost_json_files:
-
-            schema_tag = extract_schema_tag(file_path)
-            if not schema_tag or schema_tag == "No $schema tag found":
-                continue
-
-            schema_file_path = get_schema_file_path(schema_tag, schemas_folder)
-            if not schema_file_path:
-                continue
-
-            schema = load_json_file(schema_file_path)
-            doc = load_json_file(file_path)
-            if not schema or not doc:
-                continue
-
-            schema_props = extract_top_level_properties(schema)
-            doc_props = set(doc.keys()) - schema_keywords
-
-            # Extra fields are those in doc_props but not in schema_props
-            extra_fields = doc_props - schema_props
-            extra_count = len(extra_fields)
-            extra_counts.append(extra_count)
-
+def plot_extra_fields_boxplot(document_facts):
+    # Extra fields are those in the document but not in the schema
+    extra_counts = [
+        fact['extra_count']
+        for fact in document_facts
+        if fact['extra_count'] is not None
+    ]
 
     if not extra_counts:
         print("No data to plot for extra fields.")
@@ -603,31 +1229,68 @@ def plot_extra_fields_boxplot(innermost_json_files, schemas_folder):
         print(f"Number of documents excluded as outliers: {num_outliers}")
 
         # Plot the box plot
-        plt.figure(figsize=(6, 6))
-        plt.boxplot(extra_counts, showfliers=True)
-        plt.title("Box Plot of Extra Fields per Document")
-        plt.ylabel('Number of Extra Fields')
-        plt.grid(True)
-        plt.tight_layout()
-        plt.show()
+        plotting.render(_draw_boxplot, extra_counts, "Box Plot of Extra Fields per Document",
+                        'Number of Extra Fields', 'extra_fields_boxplot')
     except Exception as e:
         print(f"Error while plotting: {e}")
 
 
-def plot_complexity_vs_missing_with_colormap(differences, schema_file_counts):
+def binned_kde(xy, grid_size=256, max_grid_size=1024):
+    """
+    Estimate a 2D Gaussian KDE at each point in near-linear time. Points are
+    whitened with the Cholesky factor of the kernel covariance, which is the
+    data covariance scaled by Scott's rule like gaussian_kde, so the kernel
+    becomes a unit Gaussian. The whitened points are binned on a grid which
+    is convolved with the kernel using an FFT, and the density at each point
+    is interpolated from the grid.
+    """
+    n = xy.shape[1]
+    covariance = np.atleast_2d(np.cov(xy)) * n ** (-2.0 / 6)
+    try:
+        factor = np.linalg.cholesky(covariance)
+    except np.linalg.LinAlgError:
+        # Constant or collinear dimensions would give a zero-width kernel
+        variance = np.diag(covariance).copy()
+        variance[~(variance > 0)] = 1.0
+        factor = np.diag(np.sqrt(variance))
+    z = np.linalg.solve(factor, xy - xy.mean(axis=1, keepdims=True))
+
+    # Pad the grid so the kernel is not clipped at the edges
+    lower = z.min(axis=1) - 4
+    upper = z.max(axis=1) + 4
+
+    # Use cells no wider than half a bandwidth so binning does not blur the estimate
+    bins = np.clip(np.ceil((upper - lower) * 2), grid_size, max_grid_size).astype(int)
+    counts, x_edges, y_edges = np.histogram2d(z[0], z[1], bins=bins, range=list(zip(lower, upper)))
+    cell = (upper - lower) / bins
+
+    kernels = []
+    for dim in range(2):
+        radius = min(int(np.ceil(4 / cell[dim])), bins[dim])
+        offsets = np.arange(-radius, radius + 1) * cell[dim]
+        kernels.append(np.exp(-0.5 * offsets ** 2) / np.sqrt(2 * np.pi))
+    kernel = np.outer(kernels[0], kernels[1])
+
+    # Densities of the whitened points are scaled back by the Jacobian
+    density_grid = np.clip(fftconvolve(counts, kernel, mode='same'), 0, None) / (n * np.prod(np.diag(factor)))
+    interpolator = RegularGridInterpolator(
+        ((x_edges[:-1] + x_edges[1:]) / 2, (y_edges[:-1] + y_edges[1:]) / 2),
+        density_grid, bounds_error=False, fill_value=None,
+    )
+    return interpolator(z.T)
+
+def plot_complexity_vs_missing_with_colormap(differences, schema_file_counts, schema_registry,
+                                             density_backend='gaussian_kde'):
     complexities = []
     avg_missing = []
     for schema_url, missing_props in differences['missing'].items():
         total_files = schema_file_counts.get(schema_url, 0)
         if total_files > 0:
             # Number of properties defined in the schema
-            schema_file_path = get_schema_file_path(schema_url, schemas_folder)
-            if not schema_file_path:
-                continue
-            schema = load_json_file(schema_file_path)
-            if not schema:
+            schema_top_level_props = schema_registry.get_top_level_properties(schema_url)
+            if schema_top_level_props is None:
                 continue
-            num_defined_props = len(extract_top_level_properties(schema))
+            num_defined_props = len(schema_top_level_props)
 
             # Average number of missing properties per document
             total_missing = sum(missing_props.values())
@@ -653,7 +1316,15 @@ def plot_complexity_vs_missing_with_colormap(differences, schema_file_counts):
 
     # Calculate density using Gaussian KDE
     xy = np.vstack([complexities, avg_missing])
-    density = gaussian_kde(xy)(xy)
+    if density_backend == 'binned':
+        density = binned_kde(xy)
+    else:
+        density = gaussian_kde(xy)(xy)
+
+    plotting.render(_draw_complexity_vs_missing, complexities, avg_missing, density)
+
+def _draw_complexity_vs_missing(complexities, avg_missing, density):
+    plt = plotting.get_pyplot()
 
     # Plotting
     plt.figure(figsize=(8, 6))
@@ -664,34 +1335,105 @@ def plot_complexity_vs_missing_with_colormap(differences, schema_file_counts):
     plt.title('Schema Complexity vs. Missing Properties (With Density)')
     plt.grid(True)
     plt.tight_layout()
-    plt.show()
+    plotting.show('complexity_vs_missing')
 
 # --- End of added functions ---
 
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default=1, type=int)
+    parser.add_argument("--shard", default=None, type=parse_shard,
+                        help="only analyze shard i of N, given as i/N")
+    parser.add_argument("--manifest", default=None,
+                        help="read the file list from this manifest, writing it first if missing")
+    parser.add_argument("--schemas_folder", default="schemas",
+                        help="use dereferenced_schemas to see properties behind $ref")
+    parser.add_argument("--scan_keys", action="store_true",
+                        help="read only the top-level keys of large documents")
+    parser.add_argument("--incremental", action="store_true",
+                        help="reuse facts from document_facts.csv for unchanged documents")
+    parser.add_argument("--bitset", action="store_true",
+                        help="count differences with interned property bitsets")
+    parser.add_argument("--nested", action="store_true",
+                        help="also compare nested properties at any depth")
+    parser.add_argument("--density_backend", default="gaussian_kde", choices=["gaussian_kde", "binned"],
+                        help="binned estimates the scatter plot density in near-linear time")
+    parser.add_argument("--metrics", default=None,
+                        help="write stage timings and skip causes to this JSON file")
+    parser.add_argument("--profile", default=None,
+                        help="write cProfile statistics for the run to this file")
+    parser.add_argument("--output_folder", default=None,
+                        help="write figures to this folder instead of showing them")
+    parser.add_argument("--image_format", default="png", choices=["png", "svg"])
+    parser.add_argument("--plot_workers", default=None, type=int)
+    args = parser.parse_args()
+
+    if args.output_folder:
+        plotting.configure(args.output_folder, args.image_format, args.plot_workers)
+
+    run_start = time.perf_counter()
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
     root_folder = 'more_fetched_data'
-    schemas_folder = 'schemas'
+    schemas_folder = args.schemas_folder
     max_folders = None  # Set to None if all folders
 
     print("Processing all JSON files")
-    innermost_json_files = get_innermost_json_files(root_folder, max_folders=max_folders)
+    if args.manifest:
+        innermost_json_files = iter_json_files_with_manifest(root_folder, args.manifest, max_folders=max_folders,
+                                                             shard=args.shard)
+    else:
+        innermost_json_files = iter_innermost_json_files(root_folder, max_folders=max_folders, shard=args.shard)
+    innermost_json_files = metrics.timed_iter(innermost_json_files, 'enumerate')
+    schema_registry = SchemaRegistry(schemas_folder)
+
+    cached_facts = None
+    if args.incremental:
+        cached_facts = {}
+        if os.path.isfile('document_facts.csv'):
+            cached_facts = {fact['path']: fact for fact in load_document_facts()}
 
     print("\nProcessing Top Level Properties:-")
 
-    differences, schema_file_counts = find_top_level_properties_difference(innermost_json_files, schemas_folder)
+    if args.workers > 1:
+        document_facts, differences, schema_file_counts = find_top_level_properties_difference_parallel(
+            list(innermost_json_files), schemas_folder, args.workers,
+            scan_keys=args.scan_keys, cached_facts=cached_facts, bitset=args.bitset
+        )
+        write_document_facts(document_facts)
+    else:
+        # Parse every document once and share the results between the analyses
+        document_facts = collect_document_facts(innermost_json_files, schema_registry, args.scan_keys, cached_facts,
+                                                diff=not args.bitset)
+        differences, schema_file_counts = find_top_level_properties_difference(
+            document_facts, schema_registry, bitset=args.bitset
+        )
+
+        # Written after counting since the bitset path fills in the per-document counts
+        write_document_facts(document_facts)
+
+    statuses = Counter(fact['status'] for fact in document_facts)
+    print("Documents by status: " + ", ".join(f"{status}={count}" for status, count in statuses.most_common()))
+
     top_level_properties_analysis()
 
+    if args.nested:
+        print("\nProcessing Nested Properties:-")
+        find_nested_properties_difference(document_facts, schema_registry)
+
     # Plot the top 5 missing and extra properties
     # plot_top_properties(differences, schema_file_counts, difference_type='missing', top_n=5)
     # plot_top_properties(differences, schema_file_counts, difference_type='extra', top_n=5)
 
-    count_top_level_properties(innermost_json_files)
+    count_top_level_properties(document_facts)
 
     # Collect property counts for schemas and documents
     schema_counts = collect_schema_property_counts(schemas_folder)
-    document_counts = collect_document_property_counts(innermost_json_files)
+    document_counts = collect_document_property_counts(document_facts)
 
     # Plot histograms of property counts
     plot_property_count_histograms(schema_counts, document_counts)
@@ -700,9 +1442,20 @@ if __name__ == "__main__":
     plot_property_count_boxplots(schema_counts, document_counts)
 
     # Plot scatter plot of schema complexity vs. missing properties
-    plot_complexity_vs_missing_with_colormap(differences, schema_file_counts)
+    plot_complexity_vs_missing_with_colormap(differences, schema_file_counts, schema_registry,
+                                             density_backend=args.density_backend)
 
     # Plot histogram of missing properties per document
-    plot_extra_fields_boxplot(innermost_json_files, schemas_folder)
+    plot_extra_fields_boxplot(document_facts)
+
+    plotting.wait()
+
+    if args.profile:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print(f"Profile has been written to '{args.profile}'")
+
+    if args.metrics:
+        write_metrics(args.metrics, metrics.stages, statuses, time.perf_counter() - run_start, args.profile)
 
 
@@ -0,0 +1,296 @@
+import argparse
+import json
+import os
+import sys
+from urllib.parse import unquote, urldefrag, urljoin
+
+from tqdm.contrib.concurrent import process_map
+
+
+# Documents loaded by this process, keyed by URL without fragment
+_document_cache = {}
+
+# Targets and their base URLs keyed by absolute reference, None if unresolvable
+_ref_targets = {}
+
+# Absolute references inside the target of each reference
+_ref_edges = {}
+
+# References whose cycle membership is known, and those which are in a cycle
+_classified_refs = set()
+_cyclic_refs = set()
+
+# Dereferenced targets keyed by absolute reference
+_resolved_cache = {}
+
+
+def encode_url(url):
+    encoded_url = (url.replace("https://", "https__slash__slash_")
+                   .replace("http://", "http__slash__slash_")
+                   .replace("/", "__slash__")
+                   .replace(":", "__colon__")
+                   .replace("?", "__question__"))
+
+    # Ensuring file ends with .json and not .json.json
+    if encoded_url.endswith(".json"):
+        return encoded_url
+    else:
+        return encoded_url + ".json"
+
+
+def decode_filename(filename):
+    """Recover the URL a schema was downloaded from using its file name."""
+    return (filename.replace("https__slash__slash_", "https://")
+            .replace("http__slash__slash_", "http://")
+            .replace("__slash__", "/")
+            .replace("__colon__", ":")
+            .replace("__question__", "?"))
+
+
+def get_base_url(schema, url):
+    """Use the schema's absolute $id as its base URL, falling back to where it was fetched from."""
+    if isinstance(schema, dict):
+        for key in ("$id", "id"):
+            schema_id = schema.get(key)
+            if isinstance(schema_id, str) and "://" in schema_id:
+                return urldefrag(schema_id)[0]
+    return url
+
+
+def load_document(url, schemas_folder):
+    """Load the document for a URL from the schemas folder, once per process."""
+    if url in _document_cache:
+        return _document_cache[url]
+
+    document = None
+    for candidate in (url, url.rstrip("#")):
+        schema_file_path = os.path.join(schemas_folder, encode_url(candidate))
+        if os.path.isfile(schema_file_path):
+            try:
+                with open(schema_file_path, "r", encoding="utf-8") as file:
+                    document = json.load(file)
+            except ValueError:
+                pass
+            break
+
+    _document_cache[url] = document
+    if document is not None:
+        # Local references inside the document are resolved against its $id
+        register_document(get_base_url(document, url), document)
+    return document
+
+
+def register_document(base_url, document):
+    """Make a document available under its base URL unless one was found there already."""
+    if _document_cache.get(base_url) is None:
+        _document_cache[base_url] = document
+
+
+def resolve_pointer(document, fragment):
+    """Resolve a JSON pointer fragment, returning None if it does not exist."""
+    if fragment == "":
+        return document
+    if not fragment.startswith("/"):
+        # Plain-name anchors are not supported
+        return None
+
+    value = document
+    for token in fragment[1:].split("/"):
+        token = unquote(token).replace("~1", "/").replace("~0", "~")
+        if isinstance(value, dict) and token in value:
+            value = value[token]
+        elif isinstance(value, list) and token.isdigit() and int(token) < len(value):
+            value = value[int(token)]
+        else:
+            return None
+    return value
+
+
+def resolve_ref(absolute_ref, schemas_folder):
+    """Return the target of an absolute reference and its base URL, or None if it cannot be resolved."""
+    if absolute_ref not in _ref_targets:
+        url, fragment = urldefrag(absolute_ref)
+        document = load_document(url, schemas_folder)
+        target = resolve_pointer(document, fragment) if document is not None else None
+        _ref_targets[absolute_ref] = None if target is None else (target, get_base_url(document, url))
+    return _ref_targets[absolute_ref]
+
+
+def child_base_url(value, base_url):
+    """Nested schemas with an absolute $id change the base URL."""
+    for key in ("$id", "id"):
+        schema_id = value.get(key)
+        if isinstance(schema_id, str) and "://" in schema_id:
+            return urldefrag(schema_id)[0]
+    return base_url
+
+
+def collect_refs(value, base_url, refs):
+    """Add the absolute form of every $ref in a value to refs."""
+    if isinstance(value, list):
+        for v in value:
+            collect_refs(v, base_url, refs)
+    elif isinstance(value, dict):
+        base_url = child_base_url(value, base_url)
+        ref = value.get("$ref")
+        if isinstance(ref, str):
+            refs.append(urljoin(base_url, ref))
+        for k, v in value.items():
+            if k != "$ref" or not isinstance(ref, str):
+                collect_refs(v, base_url, refs)
+    return refs
+
+
+def ref_edges(absolute_ref, schemas_folder):
+    """The references inside the target of a reference."""
+    if absolute_ref not in _ref_edges:
+        resolved = resolve_ref(absolute_ref, schemas_folder)
+        _ref_edges[absolute_ref] = [] if resolved is None else collect_refs(*resolved, [])
+    return _ref_edges[absolute_ref]
+
+
+def find_cyclic_refs(roots, schemas_folder):
+    """
+    Add every reference reachable from roots which is part of a cycle of
+    references to _cyclic_refs, using Tarjan's strongly connected components.
+
+    References classified by an earlier call are skipped: their whole
+    component was found then, so no new cycle can pass through them.
+    """
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+
+    for root in roots:
+        if root in index or root in _classified_refs:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(ref_edges(root, schemas_folder)))]
+        while work:
+            node, edges = work[-1]
+            for child in edges:
+                if child in _classified_refs:
+                    continue
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(ref_edges(child, schemas_folder))))
+                    break
+                if child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in ref_edges(node, schemas_folder):
+                        _cyclic_refs.update(component)
+                    _classified_refs.update(component)
+
+
+def dereference(value, base_url, schemas_folder):
+    """
+    Replace every $ref in a schema with the schema it points to. References
+    which are part of a cycle, or which cannot be resolved, are kept as
+    absolute $refs so the output stays valid JSON.
+
+    find_cyclic_refs must have been run on the references in the schema.
+    The other references only lead to finitely many targets, so each is
+    dereferenced once and cached whoever refers to it.
+    """
+    if isinstance(value, list):
+        return [dereference(v, base_url, schemas_folder) for v in value]
+    if not isinstance(value, dict):
+        return value
+
+    base_url = child_base_url(value, base_url)
+    ref = value.get("$ref")
+    siblings = {
+        k: dereference(v, base_url, schemas_folder)
+        for k, v in value.items()
+        if k != "$ref" or not isinstance(ref, str)
+    }
+    if not isinstance(ref, str):
+        return siblings
+
+    absolute_ref = urljoin(base_url, ref)
+    if absolute_ref in _cyclic_refs:
+        resolved = None
+    elif absolute_ref in _resolved_cache:
+        resolved = _resolved_cache[absolute_ref]
+    else:
+        target = resolve_ref(absolute_ref, schemas_folder)
+        resolved = None if target is None else dereference(*target, schemas_folder)
+        _resolved_cache[absolute_ref] = resolved
+
+    if resolved is None:
+        return {"$ref": absolute_ref, **siblings}
+    if isinstance(resolved, dict) and siblings:
+        return {**resolved, **siblings}
+    return resolved
+
+
+def process_file(args):
+    filename, schemas_folder, output_folder = args
+    try:
+        with open(os.path.join(schemas_folder, filename), "r", encoding="utf-8") as file:
+            schema = json.load(file)
+
+        base_url = get_base_url(schema, decode_filename(filename))
+        register_document(base_url, schema)
+        find_cyclic_refs(collect_refs(schema, base_url, []), schemas_folder)
+        dereferenced_schema = dereference(schema, base_url, schemas_folder)
+
+        with open(os.path.join(output_folder, filename), "w", encoding="utf-8") as file:
+            json.dump(dereferenced_schema, file, indent=2)
+    except (ValueError, RecursionError) as e:
+        return filename, f"{type(e).__name__}: {e}"
+
+    return filename, None
+
+
+def dereference_schemas(schemas_folder, output_folder, workers=None):
+    os.makedirs(output_folder, exist_ok=True)
+    filenames = sorted(
+        filename for filename in os.listdir(schemas_folder)
+        if filename.endswith(".json") and os.path.isfile(os.path.join(schemas_folder, filename))
+    )
+
+    results = process_map(
+        process_file,
+        [(filename, schemas_folder, output_folder) for filename in filenames],
+        max_workers=workers,
+        chunksize=10,
+    )
+
+    errors = 0
+    for filename, error in results:
+        if error:
+            errors += 1
+            sys.stderr.write(f"Error {filename}: {error}\n")
+    print(f"{len(filenames) - errors} schemas dereferenced into '{output_folder}', {errors} errors")
+
+
+if __name__ == "__main__":
+    # Increase the recursion limit to handle large schemas
+    sys.setrecursionlimit(10000)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--schemas_folder", default="schemas")
+    parser.add_argument("--output_folder", default="dereferenced_schemas")
+    parser.add_argument("--workers", default=None, type=int)
+    args = parser.parse_args()
+
+    dereference_schemas(args.schemas_folder, args.output_folder, args.workers)
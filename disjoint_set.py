@@ -0,0 +1,56 @@
+from array import array
+
+
+class DisjointSet:
+    """
+    Union-find over the integers 0 to len - 1, stored in flat arrays with
+    path compression and union by rank. Elements are added by appending so
+    the set can grow as new files arrive.
+    """
+
+    def __init__(self, size=0):
+        self.parent = array("q", range(size))
+        self.rank = bytearray(size)
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add(self):
+        """Add a new element in a set of its own and return its index."""
+        index = len(self.parent)
+        self.parent.append(index)
+        self.rank.append(0)
+        return index
+
+    def find(self, i):
+        parent = self.parent
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+
+        # Point everything on the path directly at the root
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def union(self, i, j):
+        """Merge the sets containing i and j and return the new root."""
+        i = self.find(i)
+        j = self.find(j)
+        if i == j:
+            return i
+
+        # Attach the shallower tree below the deeper one
+        if self.rank[i] < self.rank[j]:
+            i, j = j, i
+        self.parent[j] = i
+        if self.rank[i] == self.rank[j]:
+            self.rank[i] += 1
+        return i
+
+    def connected(self, i, j):
+        return self.find(i) == self.find(j)
+
+    def roots(self):
+        """The root of the set of every element, in order."""
+        return [self.find(i) for i in range(len(self.parent))]
@@ -0,0 +1,169 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import aiohttp
+import tqdm
+
+from fetch_git_history import load_commits
+from json_parsing import read_jsonl
+
+
+# Responses worth another attempt, anything else is recorded as a failure
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Allow rate requests per second on average with bursts of up to capacity."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate or 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Journal:
+    """
+    Append-only record of finished downloads so an interrupted run can be
+    resumed. Files which do not exist are recorded too, so they are not
+    requested again.
+    """
+
+    def __init__(self, journal_file):
+        self.finished = {
+            obj["path"] for obj in read_jsonl(journal_file)
+            if obj["status"] in ("done", "not_found")
+        }
+        self.file = open(journal_file, "a")
+
+    def record(self, path, status):
+        self.file.write(json.dumps({"path": path, "status": status}) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+async def download(session, bucket, base_url, path, output_folder):
+    """Download one file, returning done, not_found or the reason to retry."""
+    await bucket.acquire()
+    file_path = os.path.join(output_folder, path)
+    try:
+        async with session.get(base_url + "/" + path) as response:
+            if response.status == 404:
+                return "not_found"
+            if response.status != 200:
+                return f"HTTP {response.status}"
+
+            # Write to a temporary file so a partial download is never kept
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path + ".tmp", "wb") as f:
+                async for chunk in response.content.iter_chunked(1 << 16):
+                    f.write(chunk)
+            os.replace(file_path + ".tmp", file_path)
+            return "done"
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return type(e).__name__
+
+
+async def download_round(session, bucket, journal, paths, base_url, output_folder, concurrency, progress):
+    """Download paths with concurrency workers and return the ones to retry."""
+    queue = asyncio.Queue()
+    for path in paths:
+        queue.put_nowait(path)
+    retry = []
+
+    async def worker():
+        while not queue.empty():
+            path = queue.get_nowait()
+            status = await download(session, bucket, base_url, path, output_folder)
+            if status in ("done", "not_found"):
+                journal.record(path, status)
+                progress.update()
+            elif status.startswith("HTTP ") and int(status[5:]) not in RETRY_STATUSES:
+                journal.record(path, "failed")
+                progress.update()
+            else:
+                retry.append(path)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return retry
+
+
+async def download_files(paths, output_folder, base_url, concurrency, rate, journal_file, max_retries):
+    journal = Journal(journal_file)
+    pending = [
+        path for path in dict.fromkeys(paths)
+        if path not in journal.finished and not os.path.isfile(os.path.join(output_folder, path))
+    ]
+
+    bucket = TokenBucket(rate)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+    with tqdm.tqdm(total=len(pending)) as progress:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            for attempt in range(max_retries + 1):
+                if attempt:
+                    # Back off before going through the retry queue again
+                    await asyncio.sleep(min(60, 2 ** attempt))
+                pending = await download_round(
+                    session, bucket, journal, pending, base_url, output_folder, concurrency, progress
+                )
+                if not pending:
+                    break
+
+    for path in pending:
+        journal.record(path, "failed")
+    journal.close()
+    return pending
+
+
+def get_paths(commits_file):
+    """List <repository>/<sha>/<path> for every commit of every tracked file."""
+    return [
+        f"{repository}/{sha}/{path}"
+        for repository, pairs in sorted(load_commits(commits_file).items())
+        for sha, path in sorted(pairs)
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--commits_file", default="more_repo_commits.json")
+    parser.add_argument("--output_folder", default="more_fetched_data")
+    parser.add_argument("--base_url", default="https://raw.githubusercontent.com")
+    parser.add_argument("--concurrency", default=16, type=int)
+    parser.add_argument("--rate", default=10, type=float, help="requests per second, 0 for no limit")
+    parser.add_argument("--journal_file", default="download_journal.jsonl")
+    parser.add_argument("--max_retries", default=3, type=int)
+    args = parser.parse_args()
+
+    failed = asyncio.run(download_files(
+        get_paths(args.commits_file),
+        args.output_folder,
+        args.base_url.rstrip("/"),
+        args.concurrency,
+        args.rate,
+        args.journal_file,
+        args.max_retries,
+    ))
+    if failed:
+        sys.stderr.write(f"{len(failed)} files could not be downloaded\n")
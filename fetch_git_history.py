@@ -0,0 +1,210 @@
+import argparse
+from collections import defaultdict
+import json
+import os
+import subprocess
+import sys
+
+from tqdm.contrib.concurrent import thread_map
+
+
+# Tree entry modes of regular files, symlinks and submodules are skipped
+FILE_MODES = {b"100644", b"100755"}
+
+
+class CatFile:
+    """A long running git cat-file --batch process for one repository."""
+
+    def __init__(self, git_dir, lazy_fetch=True):
+        # Without lazy fetching a partial clone reports objects it does not
+        # have as missing instead of requesting each of them from the remote
+        self.process = subprocess.Popen(
+            ["git", "--git-dir", git_dir, "cat-file", "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=None if lazy_fetch else subprocess.DEVNULL,
+            env=None if lazy_fetch else dict(os.environ, GIT_NO_LAZY_FETCH="1"),
+        )
+
+    def get(self, spec):
+        """Return the type and content of an object, or (None, None) if it is missing."""
+        self.process.stdin.write(spec.encode("utf-8") + b"\n")
+        self.process.stdin.flush()
+
+        header = self.process.stdout.readline().rstrip(b"\n")
+        if header.endswith((b" missing", b" ambiguous")):
+            return None, None
+
+        _, object_type, size = header.rsplit(b" ", 2)
+        data = self.process.stdout.read(int(size))
+        self.process.stdout.read(1)
+        return object_type.decode(), data
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+def parse_tree(data, hash_size):
+    """Map the names in a raw tree object to their mode and object id."""
+    entries = {}
+    i = 0
+    while i < len(data):
+        space = data.index(b" ", i)
+        nul = data.index(b"\0", space)
+        entries[data[space + 1:nul]] = (data[i:space], data[nul + 1:nul + 1 + hash_size].hex())
+        i = nul + 1 + hash_size
+    return entries
+
+
+def resolve_blobs(git_dir, wanted):
+    """
+    Find the blob id of each (sha, path) by reading the trees only. With a
+    blobless clone, asking git for the blob directly would fetch every blob
+    with a separate request.
+    """
+    cat_file = CatFile(git_dir, lazy_fetch=False)
+    trees = {}
+    blobs = {}
+    try:
+        for sha, path in wanted:
+            directory, _, name = path.rpartition("/")
+            spec = sha + ":" + directory
+            if spec not in trees:
+                object_type, data = cat_file.get(spec)
+                trees[spec] = parse_tree(data, len(sha) // 2) if object_type == "tree" else {}
+
+            mode, oid = trees[spec].get(name.encode("utf-8"), (None, None))
+            if mode in FILE_MODES:
+                blobs[sha, path] = oid
+    finally:
+        cat_file.close()
+    return blobs
+
+
+def is_partial_clone(git_dir):
+    result = subprocess.run(
+        ["git", "--git-dir", git_dir, "config", "--get", "remote.origin.promisor"],
+        capture_output=True, text=True,
+    )
+    return result.stdout.strip() == "true"
+
+
+def fetch_blobs(git_dir, oids):
+    """Download the given blobs of a partial clone in a single pack."""
+    subprocess.run(
+        ["git", "--git-dir", git_dir, "-c", "fetch.negotiationAlgorithm=noop",
+         "fetch", "--quiet", "--no-tags", "--no-write-fetch-head",
+         "--recurse-submodules=no", "--filter=blob:none", "--stdin", "origin"],
+        input="".join(oid + "\n" for oid in oids),
+        text=True, check=True,
+    )
+
+
+def update_clone(url, git_dir):
+    """Create a bare blobless clone, or fetch new commits into an existing one."""
+    if os.path.isdir(git_dir):
+        subprocess.run(
+            ["git", "--git-dir", git_dir, "fetch", "--quiet", "--filter=blob:none", "origin",
+             "+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"],
+            check=True,
+        )
+    else:
+        os.makedirs(os.path.dirname(git_dir), exist_ok=True)
+        subprocess.run(
+            ["git", "clone", "--quiet", "--bare", "--filter=blob:none", url, git_dir],
+            check=True,
+        )
+
+
+def write_file(file_path, data):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(file_path + ".tmp", file_path)
+
+
+def extract_repository(args):
+    """
+    Write every requested version of the tracked paths of one repository to
+    output_folder/<repository>/<sha>/<path>. Files which already exist are kept.
+    """
+    repository, wanted, url_template, clone_folder, output_folder = args
+    wanted = [
+        (sha, path) for sha, path in wanted
+        if "\n" not in path and not os.path.isfile(os.path.join(output_folder, repository, sha, path))
+    ]
+    if not wanted:
+        return repository, 0, 0, None
+
+    git_dir = os.path.join(clone_folder, repository + ".git")
+    try:
+        cloned = not os.path.isdir(git_dir)
+        if cloned:
+            update_clone(url_template.format(repository=repository), git_dir)
+        blobs = resolve_blobs(git_dir, wanted)
+
+        # Commits pushed since the clone was made need a fetch first
+        if not cloned and len(blobs) < len(wanted):
+            update_clone(url_template.format(repository=repository), git_dir)
+            blobs.update(resolve_blobs(git_dir, [w for w in wanted if w not in blobs]))
+
+        if blobs and is_partial_clone(git_dir):
+            fetch_blobs(git_dir, sorted(set(blobs.values())))
+
+        written = 0
+        cat_file = CatFile(git_dir)
+        try:
+            for (sha, path), oid in blobs.items():
+                _, data = cat_file.get(oid)
+                if data is not None:
+                    write_file(os.path.join(output_folder, repository, sha, path), data)
+                    written += 1
+        finally:
+            cat_file.close()
+    except (OSError, subprocess.CalledProcessError) as e:
+        return repository, 0, len(wanted), str(e)
+
+    return repository, written, len(wanted) - written, None
+
+
+def load_commits(commits_file):
+    """Group the (sha, path) pairs listed in a commits file by repository."""
+    wanted = defaultdict(set)
+    with open(commits_file) as f:
+        for line in f:
+            obj = json.loads(line)
+            for commit in obj["commits"]:
+                wanted[obj["repository"]].add((commit["sha"], obj["path"]))
+    return wanted
+
+
+def main(commits_file, output_folder, clone_folder, url_template, workers):
+    wanted = load_commits(commits_file)
+    results = thread_map(
+        extract_repository,
+        [(repository, sorted(pairs), url_template, clone_folder, output_folder)
+         for repository, pairs in sorted(wanted.items())],
+        max_workers=workers,
+    )
+
+    written = missing = 0
+    for repository, repository_written, repository_missing, error in results:
+        written += repository_written
+        missing += repository_missing
+        if error:
+            sys.stderr.write(f"Error {repository}: {error}\n")
+    print(f"{written} files written to '{output_folder}', {missing} not found")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--commits_file", default="more_repo_commits.json")
+    parser.add_argument("--output_folder", default="more_fetched_data")
+    parser.add_argument("--clone_folder", default="git_clones")
+    parser.add_argument("--url_template", default="https://github.com/{repository}.git",
+                        help="clone URL, such as file:///srv/git/{repository} for local repositories")
+    parser.add_argument("--workers", default=4, type=int)
+    args = parser.parse_args()
+
+    main(args.commits_file, args.output_folder, args.clone_folder, args.url_template, args.workers)
@@ -1,82 +1,192 @@
+import argparse
+import asyncio
 import csv
 import json
 import os
-import sys
+import time
+from urllib.parse import urlencode
 
-import requests
-import requests_ratelimiter
+import aiohttp
+from requests.utils import parse_header_links
 import tqdm
 
+from download_files import TokenBucket
+from http_cache import HTTPCache, cached_get
+from json_parsing import read_jsonl
+
+
+MAX_RETRIES = 5
+
+
+class GitHubRateLimiter(TokenBucket):
+    """Token bucket whose rate follows the X-RateLimit headers of the responses."""
+
+    def __init__(self, rate):
+        super().__init__(rate)
+        self.reset_at = 0
+
+    def update(self, headers):
+        try:
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset = float(headers["X-RateLimit-Reset"])
+        except (KeyError, ValueError):
+            return
+
+        # Spread the remaining requests evenly until the limit resets
+        self.rate = max(remaining, 1) / max(1.0, reset - time.time())
+        if remaining == 0:
+            self.reset_at = reset
+
+    async def acquire(self):
+        delay = self.reset_at - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await super().acquire()
+
+
+def get_retry_delay(status, headers):
+    """
+    Seconds to wait before retrying a rate limited response, or None if the
+    response was not rate limited. The limiter already waits for the reset
+    of the primary limit, secondary limits say how long to wait.
+    """
+    if status in (403, 429) and (
+        headers.get("X-RateLimit-Remaining") == "0" or "Retry-After" in headers
+    ):
+        return float(headers.get("Retry-After", 0))
+    return None
+
+
+async def get_commits(session, cache, limiter, api_url, repo, path):
+    """
+    Return every commit which changed path, following the pagination links.
+    The result is None if the history could not be fetched and should be
+    requested again on the next run.
+    """
+    url = api_url + "/repos/" + repo + "/commits?" + urlencode({"path": path, "per_page": 100})
+    commits = []
+
+    while url:
+        for attempt in range(MAX_RETRIES):
+            try:
+                r = await cached_get(session, cache, url, limiter)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                await asyncio.sleep(2 ** attempt)
+                continue
+
+            if not r.from_cache:
+                limiter.update(r.headers)
+            delay = get_retry_delay(r.status, r.headers)
+            if delay is not None:
+                await asyncio.sleep(delay)
+                continue
+
+            try:
+                obj = json.loads(r.body)
+            except ValueError:
+                await asyncio.sleep(2 ** attempt)
+                continue
+            break
+        else:
+            return None
+
+        if not isinstance(obj, list):
+            # Missing or empty repositories are not worth asking for again
+            return [] if r.status in (404, 409) and not commits else None
+
+        # Get the commit hashes
+        for c in obj:
+            try:
+                commits.append(
+                    {"sha": c["sha"], "date": c["commit"]["committer"]["date"]}
+                )
+            except KeyError:
+                pass
+
+        # The next page URL already contains the query
+        links = parse_header_links(r.headers.get("Link", ""))
+        url = next((link["url"] for link in links if link.get("rel") == "next"), None)
+
+    return commits
+
+
+def load_checkpoint(checkpoint_file):
+    """Return the (repository, path) pairs finished by earlier runs."""
+    return {(obj["repository"], obj["path"]) for obj in read_jsonl(checkpoint_file)}
+
+
+async def collect_commits(rows, output_file, checkpoint_file, cache_file, api_url, concurrency):
+    done = load_checkpoint(checkpoint_file)
+
+    # Remove github.com/ from the beginning of the repository
+    pending = [
+        (row["repository"].split("/", maxsplit=1)[1], row)
+        for row in rows
+    ]
+    pending = [(repo, row) for repo, row in pending if (repo, row["path"]) not in done]
+
+    queue = asyncio.Queue()
+    for item in pending:
+        queue.put_nowait(item)
 
-def get_commits(session, repo, path):
-    query = {"path": path}
     headers = {
         "Accept": "application/vnd.github+json",
         "Authorization": "Bearer " + os.environ["GITHUB_TOKEN"],
         "X-GitHub-Api-Version": "2022-11-28",
     }
+    cache = HTTPCache(cache_file)
+    limiter = GitHubRateLimiter(rate=2)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=30)
 
-    try:
-        r = session.get(
-            "https://api.github.com/repos/" + repo + "/commits",
-            params=query,
-            headers=headers,
-            timeout=10,
-        )
-    except (
-        requests.exceptions.ConnectionError,
-        requests.exceptions.ReadTimeout,
-    ):
-        # Skip on request error
-        return None
-    else:
-        # Get the commit hashes
-        obj = r.json()
-        if isinstance(obj, list):
-            commits = []
-            for c in obj:
-                try:
-                    commits.append(
-                        {"sha": c["sha"], "date": c["commit"]["committer"]["date"]}
-                    )
-                except KeyError:
-                    pass
-            return commits
-        else:
-            return None
+    with open(output_file, "a") as output, open(checkpoint_file, "a") as checkpoint, \
+            tqdm.tqdm(total=len(pending)) as progress:
+        async with aiohttp.ClientSession(headers=headers, connector=connector, timeout=timeout) as session:
+            async def worker():
+                while not queue.empty():
+                    repo, row = queue.get_nowait()
+                    commits = await get_commits(session, cache, limiter, api_url, repo, row["path"])
+
+                    # Write the collected commits
+                    if commits:
+                        obj = {
+                            "repository": repo,
+                            "path": row["path"],
+                            "repoStars": row["repoStars"],
+                            "repoLastFetched": row["repoLastFetched"],
+                            "commits": commits,
+                        }
+                        output.write(json.dumps(obj) + "\n")
+                        output.flush()
+                    if commits is not None:
+                        checkpoint.write(json.dumps({"repository": repo, "path": row["path"]}) + "\n")
+                        checkpoint.flush()
+                    progress.update()
 
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
 
-def main():
-    # Initialize a new session
-    session = requests.Session()
-    adapter = requests_ratelimiter.LimiterAdapter(per_second=2)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-
-    with open("more_repos_with_json_schema.csv", "r") as csvfile:
-        # Count number of rows and reset
-        reader = csv.DictReader(csvfile)
-        rows = sum(1 for row in reader)
-        csvfile.seek(0)
-
-        reader = csv.DictReader(csvfile)
-        for row in tqdm.tqdm(reader, total=rows):
-            # Remove github.com/ from the beginning and fetch commits
-            repo = row["repository"].split("/", maxsplit=1)[1]
-            commits = get_commits(session, repo, row["path"])
-
-            # Write the collected commits
-            if commits:
-                obj = {
-                    "repository": repo,
-                    "path": row["path"],
-                    "repoStars": row["repoStars"],
-                    "repoLastFetched": row["repoLastFetched"],
-                    "commits": list(commits),
-                }
-                json.dump(obj, sys.stdout)
-                sys.stdout.write("\n")
+
+def main(repos_file, output_file, checkpoint_file, cache_file, api_url, concurrency):
+    with open(repos_file, "r") as csvfile:
+        rows = list(csv.DictReader(csvfile))
+    asyncio.run(collect_commits(rows, output_file, checkpoint_file, cache_file, api_url, concurrency))
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repos_file", default="more_repos_with_json_schema.csv")
+    parser.add_argument("--output_file", default="commits.json")
+    parser.add_argument("--checkpoint_file", default="fetch_history_checkpoint.jsonl")
+    parser.add_argument("--cache_file", default="http_cache.sqlite")
+    parser.add_argument("--api_url", default="https://api.github.com")
+    parser.add_argument("--concurrency", default=8, type=int)
+    args = parser.parse_args()
+
+    main(
+        args.repos_file,
+        args.output_file,
+        args.checkpoint_file,
+        args.cache_file,
+        args.api_url.rstrip("/"),
+        args.concurrency,
+    )
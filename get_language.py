@@ -8,6 +8,8 @@ from urllib.request import urlretrieve
 import fasttext
 import tqdm
 
+from json_parsing import load_json
+
 
 LANG_THRESHOLD = 0.1
 FASTTEXT_MODEL_URL = (
@@ -135,7 +137,7 @@ if __name__ == "__main__":
         if not f.is_file():
             continue
 
-        schema = json.load(f.open(encoding="utf-8"))
+        schema, _ = load_json(f)
         schema_str = collect_text(schema)
         langs = get_languages(schema_str)
         top_lang, prob = max(langs.items(), key=lambda x: x[1])
@@ -1,12 +1,17 @@
+import argparse
+import asyncio
 import csv
 import json
 import os
 import sys
 
+import aiohttp
 import requests
-import requests_ratelimiter
 import tqdm
 
+from fetch_history import MAX_RETRIES, GitHubRateLimiter, get_retry_delay
+from http_cache import CachingLimiterAdapter
+
 
 def get_license(session, repo):
     headers = {
@@ -35,13 +40,90 @@ def get_license(session, repo):
         return None
 
 
-def main():
-    # Initialize a new session
-    session = requests.Session()
-    adapter = requests_ratelimiter.LimiterAdapter(per_second=2)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
+def build_license_query(repos):
+    """Build one GraphQL query asking for the license of each repository."""
+    fields = []
+    for i, repo in enumerate(repos):
+        owner, name = repo.split("/", maxsplit=1)
+        fields.append(
+            f"r{i}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) "
+            "{ licenseInfo { spdxId } }"
+        )
+    return "query {\n" + "\n".join(fields) + "\n}"
+
+
+async def get_licenses_batch(session, limiter, api_url, repos):
+    """
+    Return the license of each repository in a batch, or None if the query
+    failed. Repositories which do not exist have no license, as with REST.
+    """
+    query = build_license_query(repos)
+    for attempt in range(MAX_RETRIES):
+        await limiter.acquire()
+        try:
+            async with session.post(api_url, json={"query": query}) as r:
+                limiter.update(r.headers)
+                delay = get_retry_delay(r.status, r.headers)
+                if delay is not None:
+                    await asyncio.sleep(delay)
+                    continue
+                obj = await r.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            await asyncio.sleep(2 ** attempt)
+            continue
+
+        # The whole query is rejected when rate limited or on server errors
+        data = obj.get("data") if isinstance(obj, dict) else None
+        if data is None:
+            await asyncio.sleep(2 ** attempt)
+            continue
+
+        licenses = {}
+        for i, repo in enumerate(repos):
+            license_info = (data.get(f"r{i}") or {}).get("licenseInfo")
+            licenses[repo] = license_info.get("spdxId") if license_info else None
+        return licenses
+
+    return None
+
+
+async def get_licenses_batched(repos, batch_size, concurrency, api_url):
+    """Look up licenses with concurrent batched GraphQL queries."""
+    queue = asyncio.Queue()
+    for i in range(0, len(repos), batch_size):
+        queue.put_nowait(repos[i:i + batch_size])
 
+    headers = {"Authorization": "Bearer " + os.environ["GITHUB_TOKEN"]}
+    limiter = GitHubRateLimiter(rate=2)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+    failed = 0
+
+    with tqdm.tqdm(total=len(repos)) as progress:
+        async with aiohttp.ClientSession(headers=headers, connector=connector, timeout=timeout) as session:
+            async def worker():
+                nonlocal failed
+                while not queue.empty():
+                    batch = queue.get_nowait()
+                    licenses = await get_licenses_batch(session, limiter, api_url, batch)
+
+                    # Failed batches are not written so the next run retries them
+                    if licenses is None:
+                        failed += len(batch)
+                    else:
+                        for repo in batch:
+                            json.dump({"repository": repo, "license": licenses[repo]}, sys.stdout)
+                            sys.stdout.write("\n")
+                        sys.stdout.flush()
+                    progress.update(len(batch))
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    if failed:
+        sys.stderr.write(f"{failed} repositories could not be looked up\n")
+
+
+def main(graphql=False, batch_size=50, concurrency=4, api_url="https://api.github.com/graphql"):
     # Get the already fetched repositories if they exist
     fetched_repos = set()
     if os.path.exists("licenses.json"):
@@ -57,6 +139,15 @@ def main():
             - fetched_repos
         )
 
+    if graphql:
+        asyncio.run(get_licenses_batched(sorted(repos), batch_size, concurrency, api_url))
+    else:
+        # Initialize a new session
+        session = requests.Session()
+        adapter = CachingLimiterAdapter(per_second=2)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
         for repo in tqdm.tqdm(repos):
             license = get_license(session, repo)
             obj = {"repository": repo, "license": license}
@@ -65,4 +156,12 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--graphql", action="store_true",
+                        help="look up licenses in batches with the GraphQL API")
+    parser.add_argument("--batch_size", default=50, type=int)
+    parser.add_argument("--concurrency", default=4, type=int)
+    parser.add_argument("--api_url", default="https://api.github.com/graphql")
+    args = parser.parse_args()
+
+    main(args.graphql, args.batch_size, args.concurrency, args.api_url)
@@ -1,6 +1,8 @@
 import os
 import requests
 
+from http_cache import CachingAdapter
+
 
 def encode_url(url):
     # Encode special characters in the URL
@@ -31,6 +33,12 @@ def download_json_schema(url_list, folder_name="schemas", failed_urls_file="fail
 
     failed_urls = []
 
+    # Unchanged schemas are answered from the cache on later runs
+    session = requests.Session()
+    adapter = CachingAdapter()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
     for url in url_list:
         try:
             # Encode the URL for the filename
@@ -38,7 +46,7 @@ def download_json_schema(url_list, folder_name="schemas", failed_urls_file="fail
             filepath = os.path.join(folder_name, filename)
 
             # Download the content from the URL
-            response = requests.get(url)
+            response = session.get(url)
             response.raise_for_status()  # Raise an exception for HTTP errors
 
             # Save the content to a file
@@ -0,0 +1,171 @@
+from collections import namedtuple
+from fnmatch import fnmatch
+from http.client import responses
+import json
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+import requests_ratelimiter
+
+
+DAY = 24 * 60 * 60
+
+# Seconds a cached response is used without asking the server again. After
+# that it is revalidated with a conditional request, which GitHub does not
+# count against the rate limit when the answer is 304 Not Modified.
+DEFAULT_TTLS = [
+    ("https://api.github.com/repos/*/license", 7 * DAY),
+    ("https://api.github.com/repos/*/commits?*", DAY),
+    ("*", 0),
+]
+
+# Missing resources are cached too so they are not requested on every run
+CACHED_STATUSES = {200, 404}
+
+# These describe the encoded response, but the decoded body is stored
+SKIPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+CachedResponse = namedtuple("CachedResponse", ["status", "headers", "body", "from_cache"])
+
+
+class HTTPCache:
+    """Responses to GET requests stored in SQLite with their validators."""
+
+    def __init__(self, cache_file="http_cache.sqlite", ttls=DEFAULT_TTLS):
+        self.ttls = ttls
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(cache_file, timeout=60, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "url TEXT PRIMARY KEY, status INTEGER, headers TEXT, body BLOB, stored_at REAL)"
+            )
+
+    def get_ttl(self, url):
+        for pattern, ttl in self.ttls:
+            if fnmatch(url, pattern):
+                return ttl
+        return 0
+
+    def lookup(self, url):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT status, headers, body, stored_at FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, headers, body, stored_at = row
+        return {
+            "status": status,
+            "headers": CaseInsensitiveDict(json.loads(headers)),
+            "body": body,
+            "stored_at": stored_at,
+        }
+
+    def is_fresh(self, url, entry):
+        return time.time() - entry["stored_at"] < self.get_ttl(url)
+
+    @staticmethod
+    def conditional_headers(entry):
+        """Headers asking the server to answer 304 if entry is still current."""
+        headers = {}
+        if entry is not None and entry["status"] == 200:
+            if "ETag" in entry["headers"]:
+                headers["If-None-Match"] = entry["headers"]["ETag"]
+            if "Last-Modified" in entry["headers"]:
+                headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+        return headers
+
+    def store(self, url, status, headers, body):
+        if status not in CACHED_STATUSES:
+            return
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (url, status, json.dumps({
+                    name: value for name, value in headers.items()
+                    if name.lower() not in SKIPPED_HEADERS
+                }), body, time.time()),
+            )
+
+    def revalidated(self, url, entry, headers):
+        """Renew an entry after a 304, taking the new headers from the response."""
+        entry["headers"].update(
+            (name, value) for name, value in headers.items()
+            if name.lower() not in SKIPPED_HEADERS
+        )
+        self.store(url, entry["status"], entry["headers"], entry["body"])
+        return entry
+
+
+class CachingMixin:
+    """
+    Transport adapter mixin answering GET requests from an HTTPCache. Streamed
+    responses, such as Sourcegraph searches, are always sent to the server.
+    """
+
+    def __init__(self, *args, cache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = cache or HTTPCache()
+
+    def build_cached_response(self, request, entry):
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = responses.get(entry["status"])
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response._content = entry["body"]
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def send(self, request, stream=False, **kwargs):
+        if request.method != "GET" or stream:
+            return super().send(request, stream=stream, **kwargs)
+
+        entry = self.cache.lookup(request.url)
+        if entry is not None and self.cache.is_fresh(request.url, entry):
+            return self.build_cached_response(request, entry)
+
+        request.headers.update(self.cache.conditional_headers(entry))
+        response = super().send(request, stream=stream, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            entry = self.cache.revalidated(request.url, entry, response.headers)
+            return self.build_cached_response(request, entry)
+
+        self.cache.store(request.url, response.status_code, response.headers, response.content)
+        return response
+
+
+class CachingAdapter(CachingMixin, HTTPAdapter):
+    pass
+
+
+class CachingLimiterAdapter(CachingMixin, requests_ratelimiter.LimiterMixin, HTTPAdapter):
+    """Rate limited adapter where cache hits do not use up the rate limit."""
+    pass
+
+
+async def cached_get(session, cache, url, limiter=None):
+    """
+    GET url with an aiohttp session through the cache. The limiter, if given,
+    is only acquired for requests which go to the server.
+    """
+    entry = cache.lookup(url)
+    if entry is not None and cache.is_fresh(url, entry):
+        return CachedResponse(entry["status"], entry["headers"], entry["body"], True)
+
+    if limiter is not None:
+        await limiter.acquire()
+    async with session.get(url, headers=cache.conditional_headers(entry)) as r:
+        if r.status == 304 and entry is not None:
+            entry = cache.revalidated(url, entry, r.headers)
+            return CachedResponse(entry["status"], entry["headers"], entry["body"], False)
+
+        body = await r.read()
+        cache.store(url, r.status, r.headers, body)
+        return CachedResponse(r.status, CaseInsensitiveDict(r.headers), body, False)
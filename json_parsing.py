@@ -0,0 +1,39 @@
+import json
+import os
+
+
+def load_json(file_path, allow_json5=False):
+    """
+    Load a JSON file and return the data along with the name of the parser
+    which succeeded. The C accelerated json module is tried first. With
+    allow_json5 the much slower json5 parser is used for files it rejects.
+    """
+    with open(file_path, 'rb') as file:
+        data = file.read()
+
+    try:
+        return json.loads(data.decode('utf-8')), 'json'
+    except ValueError:
+        if not allow_json5:
+            raise
+
+    import json5
+    with open(file_path) as file:
+        return json5.load(file), 'json5'
+
+
+def read_jsonl(file_path):
+    """
+    Yield the objects of a JSON Lines file which is appended to as work
+    finishes, such as a journal or checkpoint. A missing file has no objects.
+    """
+    if not os.path.isfile(file_path):
+        return
+
+    with open(file_path) as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run
+                continue
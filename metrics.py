@@ -0,0 +1,66 @@
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class RunMetrics:
+    """Accumulate wall time and item counts per pipeline stage."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, seconds, count=1):
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'count': 0})
+        stage['seconds'] += seconds
+        stage['count'] += count
+
+    @contextmanager
+    def stage(self, name, count=1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, count)
+
+    def timed_iter(self, iterable, name):
+        """Yield from iterable, counting the time spent producing each item."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, time.perf_counter() - start, 0)
+                return
+            self.add(name, time.perf_counter() - start)
+            yield item
+
+    def merge(self, stages):
+        for name, stage in stages.items():
+            self.add(name, stage['seconds'], stage['count'])
+
+    def reset(self):
+        self.stages = {}
+
+
+# Metrics for the current process
+metrics = RunMetrics()
+
+
+def write_metrics(output_file, stages, statuses, wall_seconds, profile_file=None):
+    """Write stage timings and per-cause document counts to a JSON file."""
+    statuses = Counter(statuses)
+    report = {
+        'wall_seconds': wall_seconds,
+        'documents': sum(statuses.values()),
+        'statuses': dict(statuses.most_common()),
+        'stages': {
+            name: dict(stage, per_item_ms=stage['seconds'] / stage['count'] * 1000 if stage['count'] else None)
+            for name, stage in stages.items()
+        },
+        'profile': profile_file,
+    }
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Run metrics have been written to '{output_file}'")
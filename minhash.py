@@ -0,0 +1,121 @@
+from collections import defaultdict
+import hashlib
+import json
+
+import numpy as np
+from tqdm.contrib.concurrent import process_map
+
+
+# Multiplier of the polynomial rolling hash over shingle bytes
+SHINGLE_BASE = np.uint64(1099511628211)
+SHINGLE_SIZE = 9
+
+
+def canonicalize(text):
+    """
+    Serialize JSON with sorted keys and no insignificant whitespace so that
+    formatting and key order do not affect similarity.
+    """
+    try:
+        return json.dumps(json.loads(text), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    except ValueError:
+        return " ".join(text.split())
+
+
+def shingle_hashes(text, shingle_size):
+    """Hash every run of shingle_size bytes of text, without duplicates."""
+    data = np.frombuffer(text.encode("utf-8"), dtype=np.uint8).astype(np.uint64)
+    shingle_size = max(1, min(shingle_size, len(data)))
+    count = len(data) - shingle_size + 1
+    if count <= 0:
+        return np.zeros(1, dtype=np.uint64)
+
+    # Overflow wraps around, which is what we want for hashing
+    hashes = np.zeros(count, dtype=np.uint64)
+    for i in range(shingle_size):
+        hashes = hashes * SHINGLE_BASE + data[i:i + count]
+    return np.unique(hashes)
+
+
+def get_permutations(num_perm, seed=1):
+    """Random odd multipliers and offsets for multiply-shift hashing."""
+    rng = np.random.RandomState(seed)
+    high, low = rng.randint(0, 1 << 32, size=(2, 2, num_perm), dtype=np.uint64)
+    a = (high[0] << np.uint64(32)) | low[0] | np.uint64(1)
+    b = (high[1] << np.uint64(32)) | low[1]
+    return a, b
+
+
+def get_signature(hashes, a, b, chunk_size=4096):
+    """The MinHash signature of a set of shingle hashes."""
+    signature = np.full(len(a), np.iinfo(np.uint64).max, dtype=np.uint64)
+    for start in range(0, len(hashes), chunk_size):
+        chunk = hashes[start:start + chunk_size]
+        values = (np.outer(a, chunk) + b[:, None]) >> np.uint64(32)
+        signature = np.minimum(signature, values.min(axis=1))
+    return signature
+
+
+def compute_signature(args):
+    """Return the MinHash signature of a file and a digest of its canonical text."""
+    file_path, shingle_size, num_perm = args
+    text = canonicalize(open(file_path).read().strip())
+    a, b = get_permutations(num_perm)
+    signature = get_signature(shingle_hashes(text, shingle_size), a, b)
+    return signature, hashlib.sha1(text.encode("utf-8")).digest()
+
+
+def candidate_probability(similarity, bands, rows):
+    """The chance that LSH makes two sets with this Jaccard similarity candidates."""
+    return 1 - (1 - similarity ** rows) ** bands
+
+
+def choose_bands(num_perm, threshold, recall=0.95):
+    """
+    Choose the number of bands and rows per band for LSH. Of the splits which
+    make pairs at the threshold candidates with probability recall, take the
+    one with the fewest candidates below it.
+    """
+    options = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    good = [o for o in options if candidate_probability(threshold, *o) >= recall]
+    if not good:
+        return max(options, key=lambda o: candidate_probability(threshold, *o))
+    return min(good, key=lambda o: candidate_probability(threshold / 2, *o))
+
+
+def jaccard_threshold(distance):
+    """
+    The Jaccard similarity of the shingles of two texts whose normalized edit
+    distance is distance, when the edits are in a few places as they usually
+    are between versions of a schema. Scattered edits change more shingles.
+    """
+    return (1 - distance) / (1 + distance)
+
+
+def find_candidates(files, threshold, num_perm=128, shingle_size=SHINGLE_SIZE, workers=None):
+    """
+    Group files which are likely to have a Jaccard similarity of at least
+    threshold. Returns the groups of files with identical canonical text and
+    the groups of candidates, each a list of indexes into files.
+    """
+    results = process_map(
+        compute_signature,
+        [(f, shingle_size, num_perm) for f in files],
+        max_workers=workers,
+        chunksize=100,
+    )
+
+    exact = defaultdict(list)
+    for i, (_, digest) in enumerate(results):
+        exact[digest].append(i)
+
+    buckets = defaultdict(list)
+    bands, rows = choose_bands(num_perm, threshold)
+    for i, (signature, _) in enumerate(results):
+        for band in range(bands):
+            buckets[band, signature[band * rows:(band + 1) * rows].tobytes()].append(i)
+
+    return (
+        [group for group in exact.values() if len(group) > 1],
+        [bucket for bucket in buckets.values() if len(bucket) > 1],
+    )
@@ -0,0 +1,80 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Figures are shown interactively unless an output folder is configured
+_output_folder = None
+_image_format = 'png'
+_workers = None
+_executor = None
+_pending = []
+
+
+def _configure_worker(output_folder, image_format):
+    global _output_folder, _image_format
+    _output_folder = output_folder
+    _image_format = image_format
+
+
+def configure(output_folder=None, image_format='png', workers=None):
+    """
+    Switch to headless rendering. Figures are written to output_folder as
+    image_format files and drawn in a pool of worker processes.
+    """
+    global _output_folder, _image_format, _workers
+    _output_folder = output_folder
+    _image_format = image_format
+    _workers = workers
+    if output_folder:
+        os.makedirs(output_folder, exist_ok=True)
+
+
+def get_pyplot():
+    """Import pyplot on first use so runs without plots never load matplotlib."""
+    import matplotlib
+    if _output_folder:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def show(name):
+    """Show the current figure, or save it as name when rendering headless."""
+    plt = get_pyplot()
+    if _output_folder:
+        plt.savefig(os.path.join(_output_folder, f'{name}.{_image_format}'))
+        plt.close()
+    else:
+        plt.show()
+
+
+def render(draw_function, *args):
+    """
+    Draw a figure. Headless figures are drawn in a worker process so the
+    caller can carry on computing; call wait() before exiting.
+    """
+    global _executor
+    if not _output_folder:
+        draw_function(*args)
+        return
+
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=_workers,
+            initializer=_configure_worker,
+            initargs=(_output_folder, _image_format),
+        )
+    _pending.append(_executor.submit(draw_function, *args))
+
+
+def wait():
+    """Wait for all headless figures to be written, raising the first error."""
+    global _executor
+    try:
+        for future in _pending:
+            future.result()
+    finally:
+        _pending.clear()
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
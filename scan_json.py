@@ -0,0 +1,156 @@
+import json
+import re
+
+import numpy as np
+
+
+# Smaller documents are parsed faster by json.loads than numpy can set up
+SCAN_MIN_SIZE = 1 << 16
+
+# Stands in for a nested object or array in the top-level skeleton
+NESTED = 0
+
+# The skeleton of a top-level object, where each string is reduced to its
+# closing quote and each nested value to NESTED
+_WS = rb'[ \t\r\n]*'
+_SCALAR = rb'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?|true|false|null'
+_VALUE = _WS + rb'(?:"|\x00|' + _SCALAR + rb')' + _WS
+_PAIR = _WS + rb'"' + _WS + rb':' + _VALUE
+SKELETON = re.compile(_WS + rb'\{(?:' + _PAIR + rb'(?:,' + _PAIR + rb')*|' + _WS + rb')\}' + _WS)
+
+# Clearing this bit maps { to [ and } to ]
+CASE_BIT = 0x20
+
+
+class ScanFallback(Exception):
+    """Raised when the scanner sees something it does not handle."""
+
+
+def find_string_delimiters(chars):
+    """Positions of the quotes which start or end a string."""
+    quotes = np.flatnonzero(chars == ord('"'))
+    backslashes = np.flatnonzero(chars == ord('\\'))
+    if not len(backslashes):
+        return quotes
+
+    # A quote is escaped if it ends an odd number of backslashes
+    escapable = np.flatnonzero(chars[np.maximum(quotes - 1, 0)] == ord('\\'))
+    escapable = escapable[quotes[escapable] > 0]
+    run_starts = backslashes[np.r_[True, np.diff(backslashes) != 1]]
+    before = quotes[escapable] - 1
+    run_lengths = before + 1 - run_starts[np.searchsorted(run_starts, before, side='right') - 1]
+    return np.delete(quotes, escapable[run_lengths % 2 == 1])
+
+
+def scan(data):
+    """
+    Return the set of top-level keys of a JSON object and its $schema string
+    (or None) without building the nested values.
+
+    Quotes and brackets are located for the whole document at once with
+    numpy, which gives the nested values to skip, and only the top-level
+    skeleton is looked at in Python. Brackets must match at every depth and
+    the top level must be valid JSON, but scalars inside nested values are
+    not checked, so a document with a malformed nested number or literal is
+    accepted here while json.load would reject it.
+    """
+    chars = np.frombuffer(data, dtype=np.uint8)
+    delimiters = find_string_delimiters(chars)
+    if len(delimiters) % 2:
+        raise ScanFallback('unterminated string')
+
+    # Brackets are structural unless an odd number of quotes precede them
+    folded = chars & ~np.uint8(CASE_BIT)
+    brackets = np.flatnonzero((folded == ord('[')) | (folded == ord(']')))
+    brackets = brackets[np.searchsorted(delimiters, brackets) % 2 == 0]
+
+    change = np.where(folded[brackets] == ord('['), 1, -1)
+    depth_after = np.cumsum(change)
+    depth_before = depth_after - change
+    nested_starts = brackets[(depth_before == 1) & (depth_after == 2)]
+    nested_ends = brackets[(depth_before == 2) & (depth_after == 1)]
+    if len(nested_starts) != len(nested_ends) or depth_after.min(initial=0) < 0:
+        raise ScanFallback('unbalanced brackets')
+
+    # Ordered by depth and then position, each opening bracket is followed by
+    # the one which closes it, which must be of the same kind
+    opening = change == 1
+    order = np.lexsort((brackets, np.where(opening, depth_after, depth_before)))
+    if len(order) % 2 or not opening[order[0::2]].all() or opening[order[1::2]].any():
+        raise ScanFallback('unbalanced brackets')
+    if (chars[brackets[order[1::2]]] != chars[brackets[order[0::2]]] + 2).any():
+        raise ScanFallback('mismatched brackets')
+
+    # Strings outside of nested values
+    string_starts = delimiters[0::2]
+    string_ends = delimiters[1::2]
+    container = np.searchsorted(nested_starts, string_starts) - 1
+    top_level = container < 0
+    if len(nested_ends):
+        top_level |= string_starts > nested_ends[container]
+
+    # Replace each top-level string by its quote and each nested value by
+    # NESTED to get the skeleton of the object
+    spans = sorted(
+        [(start, end, b'"') for start, end in zip(string_starts[top_level], string_ends[top_level])]
+        + [(start, end, bytes([NESTED])) for start, end in zip(nested_starts, nested_ends)]
+    )
+    pieces = []
+    strings = []
+    previous = 0
+    for start, end, replacement in spans:
+        pieces.append(data[previous:start])
+        pieces.append(replacement)
+        if replacement == b'"':
+            strings.append(data[start:end + 1])
+        previous = end + 1
+    pieces.append(data[previous:])
+    skeleton = b''.join(pieces)
+    if not SKELETON.fullmatch(skeleton):
+        raise ScanFallback('unexpected top-level structure')
+
+    def read_string(raw):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            raise ScanFallback('invalid string')
+
+    keys = set()
+    schema_tag = None
+    strings = iter(strings)
+    inner = skeleton.strip()[1:-1].strip()
+    for pair in inner.split(b',') if inner else []:
+        key = read_string(next(strings))
+        keys.add(key)
+        value = pair.split(b':')[1].strip()
+        if value == b'"':
+            value = read_string(next(strings))
+        if key == '$schema':
+            # Duplicate keys keep the last value like json.load
+            schema_tag = value if isinstance(value, str) else None
+
+    return keys, schema_tag
+
+
+def scan_top_level_properties(file_path):
+    """
+    Return the top-level keys of a JSON document and its $schema string.
+
+    The keys are None if the document is not an object and the $schema
+    string is None if it is missing or not a string. Documents the scanner
+    cannot handle are parsed in full, so decode errors are raised as usual.
+    """
+    with open(file_path, 'rb') as file:
+        data = file.read()
+
+    if len(data) >= SCAN_MIN_SIZE:
+        try:
+            return scan(data)
+        except ScanFallback:
+            pass
+
+    data = json.loads(data.decode('utf-8'))
+    if not isinstance(data, dict):
+        return None, None
+    schema_tag = data.get('$schema')
+    return set(data.keys()), schema_tag if isinstance(schema_tag, str) else None
@@ -0,0 +1,183 @@
+import csv
+import json
+import os
+import sys
+import time
+
+import requests
+import requests_ratelimiter
+import tqdm
+
+
+MATCH_COLUMNS = ["repository", "repoStars", "repoLastFetched", "commit", "path"]
+
+# Status codes where the server asks us to slow down and try again
+RETRY_STATUSES = {429, 503}
+MAX_RETRIES = 5
+
+
+def get_search_url():
+    # SRC_ENDPOINT is also what the Sourcegraph CLI uses to pick an instance
+    return os.environ.get("SRC_ENDPOINT", "https://sourcegraph.com").rstrip("/") + "/.api/search/stream"
+
+
+def create_session(pool_size=10):
+    """A session whose requests share one connection pool and rate limit."""
+    session = requests.Session()
+    adapter = requests_ratelimiter.LimiterAdapter(per_second=2, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def iter_lines(chunks):
+    """Split byte chunks into lines ending in CRLF, LF or CR."""
+    partial = []
+    for chunk in chunks:
+        # Avoid re-scanning long lines which arrive in many chunks
+        if b"\n" not in chunk and b"\r" not in chunk:
+            partial.append(chunk)
+            continue
+
+        lines = (b"".join(partial) + chunk).splitlines(keepends=True)
+
+        # A trailing CR could still be followed by the LF of a CRLF
+        partial = [] if lines[-1].endswith(b"\n") else [lines.pop()]
+        for line in lines:
+            yield line.rstrip(b"\r\n")
+
+    if partial:
+        yield from b"".join(partial).splitlines()
+
+
+def parse_events(chunks):
+    """
+    Incrementally parse a server-sent event stream from byte chunks, yielding
+    (event, data) pairs. Multi-line data fields are joined with newlines.
+    """
+    event = None
+    data = []
+    for line in iter_lines(chunks):
+        line = line.decode("utf-8")
+        if not line:
+            # A blank line dispatches the event
+            if data:
+                yield event or "message", "\n".join(data)
+            event = None
+            data = []
+            continue
+        if line.startswith(":"):
+            # Comment, used as a keep-alive
+            continue
+
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "event":
+            event = value
+        elif field == "data":
+            data.append(value)
+
+    if data:
+        yield event or "message", "\n".join(data)
+
+
+def stream_search(query, session=None):
+    """
+    Run a streaming search and yield (event, data) pairs with the data decoded
+    from JSON. Requests the server rejects with 429 or 503 are retried after
+    the delay it gives in Retry-After.
+    """
+    session = session or create_session()
+    for attempt in range(MAX_RETRIES):
+        with session.get(
+            get_search_url(),
+            params={"q": query},
+            headers={
+                "Accept": "text/event-stream",
+                "Authorization": "token " + os.environ["SRC_ACCESS_TOKEN"],
+            },
+            stream=True,
+        ) as resp:
+            if resp.status_code in RETRY_STATUSES:
+                time.sleep(float(resp.headers.get("Retry-After", 2 ** attempt)))
+                continue
+            resp.raise_for_status()
+
+            for event, data in parse_events(resp.iter_content(chunk_size=None)):
+                yield event, json.loads(data)
+            return
+
+    raise requests.exceptions.RetryError(f"Search was throttled {MAX_RETRIES} times: {query}")
+
+
+def search(query, on_matches=None, on_progress=None, on_filters=None, on_other=None, session=None):
+    """Run a streaming search, calling the handler for each type of event."""
+    handlers = {"matches": on_matches, "progress": on_progress, "filters": on_filters}
+    for event, data in stream_search(query, session):
+        if event in handlers:
+            if handlers[event] is not None:
+                handlers[event](data)
+        elif on_other is not None:
+            on_other(event, data)
+
+
+def match_row(m):
+    """The values of a match in the order of MATCH_COLUMNS."""
+    return (
+        m["repository"],
+        m.get("repoStars", ""),
+        m.get("repoLastFetched", ""),
+        m["commit"],
+        m["path"],
+    )
+
+
+class MatchWriter:
+    """Write search matches as CSV rows in batches rather than per event."""
+
+    def __init__(self, file, extra=(), buffer_size=1000):
+        self.writer = csv.writer(file)
+        self.extra = tuple(extra)
+        self.buffer_size = buffer_size
+        self.rows = []
+        self.count = 0
+
+    def write(self, matches):
+        for m in matches:
+            self.rows.append(match_row(m) + self.extra)
+        self.count += len(matches)
+        if len(self.rows) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.writer.writerows(self.rows)
+        self.rows = []
+
+
+def write_search_results(query, file, extra=(), session=None):
+    """
+    Write every match of a search to a CSV file, with the values in extra
+    appended to each row. Progress and other events are reported on stderr.
+    Returns the number of matches.
+    """
+    writer = MatchWriter(file, extra)
+    pbar = tqdm.tqdm()
+
+    def on_matches(matches):
+        writer.write(matches)
+        pbar.update(len(matches))
+
+    def on_progress(data):
+        sys.stderr.write(json.dumps(data) + "\n")
+
+    def on_other(event, data):
+        sys.stderr.write(event + "\n")
+
+    try:
+        # We don't need to record filtering information
+        search(query, on_matches, on_progress, None, on_other, session)
+    finally:
+        writer.flush()
+        pbar.close()
+    return writer.count
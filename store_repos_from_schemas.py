@@ -1,13 +1,15 @@
 import json
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import csv
 import sys
-import os
-import time
+
 import requests
-import requests_ratelimiter
-import csv
 import tqdm
 
+from json_parsing import read_jsonl
+from sourcegraph import MATCH_COLUMNS, create_session, match_row, search
+
 
 def get_id(file_path):
     ids = set()
@@ -34,83 +36,87 @@ def load_links_from_file(file_path):
     return urls
 
 
-def get_repos(outfile, url):
-    query = f'count:all file:\\.json$ content:\'"$schema": "{url}\''
-    print(query)
-    session = requests.Session()
-    adapter = requests_ratelimiter.LimiterAdapter(per_second=2)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    matches = 0
-
-    with session.get(
-            "https://sourcegraph.com/.api/search/stream",
-            params={"q": query},
-            headers={
-                "Accept": "text/event-stream",
-                "Authorization": "token " + os.environ["SRC_ACCESS_TOKEN"],
-            },
-            stream=True,
-    ) as resp, open(outfile, "a", newline='') as f:  # Open in append mode
-        pbar = tqdm.tqdm()
-        writer = csv.writer(f)
+def get_query(url):
+    return f'count:all file:\\.json$ content:\'"$schema": "{url}\''
 
-        event = None
-        for line in resp.iter_lines():
-            if not line:
-                continue
-            time.sleep(0.1)
-            line = line.decode("utf-8").strip()
-
-            if line.startswith("event:"):
-                event = line.split(":", maxsplit=1)[1].strip()
-                if event != "matches":
-                    sys.stderr.write(event + "\n")
-            elif line.startswith("data:"):
-                data = line.split(":", maxsplit=1)[1].strip()
-
-                if event == "filters":
-                    continue
-                if event == "matches":
-                    record = [
-                        (
-                            m["repository"],
-                            m.get("repoStars", ""),
-                            m.get("repoLastFetched", ""),
-                            m["commit"],
-                            m["path"],
-                            url
-                        )
-                        for m in json.loads(data)
-                    ]
-                    writer.writerows(record)
-                    matches += len(record)
-                    pbar.update(len(record))
-                elif event == "progress":
-                    sys.stderr.write(data + "\n")
-
-
-def store_repos(schema_file, links_file, outfile):
-    # Create or overwrite the file and write the header
-    with open(outfile, "w", newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(
-            ["repository", "repoStars", "repoLastFetched", "commit", "path", "url"]
-        )
 
+def search_url(url, session):
+    """Return the match rows of the search for one schema URL."""
+    rows = []
+    search(get_query(url), on_matches=lambda matches: rows.extend(match_row(m) for m in matches),
+           session=session)
+    return rows
+
+
+def add_matches(files, url, rows):
+    """Record that url matched each file, keeping one entry per file."""
+    for repository, stars, last_fetched, commit, path in rows:
+        entry = files.setdefault((repository, commit, path), [stars, last_fetched, set()])
+        entry[0], entry[1] = stars, last_fetched
+        entry[2].add(url)
+
+
+def load_url_checkpoint(checkpoint_file, files):
+    """Add the matches of URLs searched by earlier runs and return those URLs."""
+    done = set()
+    for obj in read_jsonl(checkpoint_file):
+        add_matches(files, obj["url"], obj["matches"])
+        done.add(obj["url"])
+    return done
+
+
+def store_repos(schema_file, links_file, outfile, workers=8, checkpoint_file=None):
+    """
+    Search for the files using each schema URL. The searches run concurrently
+    over one rate limited connection pool, and every file is written once
+    with all the URLs which matched it. Finished URLs are checkpointed so an
+    interrupted sweep continues where it stopped.
+    """
     # ids = get_id("schemas.json")
     ids = get_id(schema_file)
     # links = load_links_from_file("json-schema-ids.txt")
     links = load_links_from_file(links_file)
     total_urls = ids.union(links)
 
-    for url in total_urls:
-        get_repos(outfile, url)
+    checkpoint_file = checkpoint_file or outfile + ".checkpoint.jsonl"
+    files = {}
+    pending = sorted(total_urls - load_url_checkpoint(checkpoint_file, files))
+
+    session = create_session(pool_size=workers)
+    failed = 0
+    with open(checkpoint_file, "a") as checkpoint, ThreadPoolExecutor(workers) as executor:
+        futures = {executor.submit(search_url, url, session): url for url in pending}
+        for future in tqdm.tqdm(as_completed(futures), total=len(futures)):
+            url = futures[future]
+            try:
+                rows = future.result()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                # Not checkpointed, so the next run searches it again
+                sys.stderr.write(f"Error {url}: {e}\n")
+                failed += 1
+                continue
+
+            add_matches(files, url, rows)
+            checkpoint.write(json.dumps({"url": url, "matches": rows}) + "\n")
+            checkpoint.flush()
+
+    # Create or overwrite the file and write the header
+    with open(outfile, "w", newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(MATCH_COLUMNS + ["urls"])
+        for (repository, commit, path), (stars, last_fetched, urls) in sorted(files.items()):
+            writer.writerow([repository, stars, last_fetched, commit, path, " ".join(sorted(urls))])
+
+    print(f"{len(files)} files matched {len(total_urls) - failed} URLs, {failed} searches failed")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--outfile", required=True)
+    parser.add_argument("--workers", default=8, type=int)
+    parser.add_argument("--checkpoint_file", default=None,
+                        help="defaults to the output file name with .checkpoint.jsonl appended")
     args = parser.parse_args()
-    store_repos("schemas.json", "json-schema-ids.txt", outfile=args.outfile)
+    store_repos("schemas.json", "json-schema-ids.txt", outfile=args.outfile,
+                workers=args.workers, checkpoint_file=args.checkpoint_file)
 
@@ -3,13 +3,10 @@ import json
 import re
 import argparse
 import validators
-import sys
 import os
-import requests
-import requests_ratelimiter
 import csv
-import time
-import tqdm
+
+from sourcegraph import MATCH_COLUMNS, write_search_results
 
 
 def get_content_id(data, json_data_id_list):
@@ -32,60 +29,11 @@ def get_repos(outfile, content_url):
     # print(content_query)
     query = f'count:all file:\\.json$ content:\'"$schema": "{content_url}\''
     print(query)
-    session = requests.Session()
-    adapter = requests_ratelimiter.LimiterAdapter(per_second=2)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    matches = 0
     output_file = 'response_output.txt'
-    with session.get(
-        "https://sourcegraph.com/.api/search/stream",
-        params={"q": query},
-        headers={
-            "Accept": "text/event-stream",
-            "Authorization": "token " + os.environ["SRC_ACCESS_TOKEN"],
-        },
-        stream=True,
-    ) as resp, open(outfile, "w") as f:
-        pbar = tqdm.tqdm()
+    with open(outfile, "w") as f:
         writer = csv.writer(f)
-        writer.writerow(
-            ["repository", "repoStars", "repoLastFetched", "commit", "path"]
-        )
-        event = None
-        for line in resp.iter_lines():
-            if not line:
-                continue
-            time.sleep(0.1)
-            line = line.decode("utf-8").strip()
-
-            if line.startswith("event:"):
-                event = line.split(":", maxsplit=1)[1].strip()
-                if event != "matches":
-                    sys.stderr.write(event + "\n")
-            elif line.startswith("data:"):
-                data = line.split(":", maxsplit=1)[1].strip()
-
-                if event == "filters":
-                    # We don't need to record filtering information
-                    continue
-                if event == "matches":
-                    record = [
-                        (
-                            m["repository"],
-                            m.get("repoStars", ""),
-                            m.get("repoLastFetched", ""),
-                            m["commit"],
-                            m["path"],
-                            content_url
-                        )
-                        for m in json.loads(data)
-                    ]
-                    writer.writerows(record)
-                    matches += len(record)
-                    pbar.update(len(record))
-                elif event == "progress":
-                    sys.stderr.write(data + "\n")
+        writer.writerow(MATCH_COLUMNS)
+        write_search_results(query, f, extra=(content_url,))
 
 
 def store_repos(outfile):
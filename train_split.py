@@ -1,18 +1,21 @@
 import argparse
 import copy
+from functools import lru_cache
 import gzip
+import hashlib
+import itertools
 import json
 import os
 from pathlib import Path
 import sys
 
-import numpy as np
 import pybktree
-from sklearn.model_selection import GroupShuffleSplit
 import tqdm
-import unionfind
 import Levenshtein
 
+from disjoint_set import DisjointSet
+import minhash
+
 
 PERMISSIVE_LICENSES = set(json.load(open("permissive_licenses.json")))
 
@@ -72,73 +75,122 @@ def get_repo_data(file, key):
     return data
 
 
-def main(similarity, split, seed, commits_file, licenses_file, languages_file):
+def normalized_distance(a, b):
+    return Levenshtein.distance(a, b) / max(len(a), len(b), 1)
+
+
+@lru_cache(maxsize=4096)
+def read_canonical_schema(path):
+    return minhash.canonicalize(open(path).read().strip())
+
+
+def assign_split(key, split, seed):
+    """
+    Place a group in train, test or validation from a hash of its key. The
+    choice depends only on the key, so groups keep their split when other
+    files are added. Whatever is not in train is divided evenly between test
+    and validation.
+    """
+    digest = hashlib.sha256(f"{seed}:{key}".encode("utf-8")).digest()
+    value = int.from_bytes(digest[:8], "big") / 2 ** 64
+    if value < split:
+        return "train"
+    return "test" if value < (1 + split) / 2 else "validation"
+
+
+def group_near_duplicates(uf, files, similarity, verify=False, workers=None):
+    """
+    Group files whose content is similar using MinHash signatures and LSH.
+    Candidates are files whose shingles are about as similar as those of
+    files at a normalized edit distance of similarity. With verify,
+    candidates are only grouped if the edit distance of their canonical text
+    is at most similarity.
+    """
+    exact, candidates = minhash.find_candidates(files, minhash.jaccard_threshold(similarity), workers=workers)
+
+    # Files with the same canonical content need no verification
+    for group in exact:
+        for other in group[1:]:
+            uf.union(group[0], other)
+
+    for group in tqdm.tqdm(candidates):
+        if not verify:
+            for other in group[1:]:
+                uf.union(group[0], other)
+            continue
+
+        for i, j in itertools.combinations(group, 2):
+            if uf.connected(i, j):
+                continue
+            distance = normalized_distance(read_canonical_schema(files[i]), read_canonical_schema(files[j]))
+            if distance <= similarity:
+                uf.union(i, j)
+
+
+def main(similarity, split, seed, commits_file, licenses_file, languages_file,
+         similarity_backend="bktree", verify=False, workers=None):
     licenses = get_repo_data(licenses_file, "license")
     languages = get_repo_data(languages_file, "language")
     files = files_list(licenses)
 
-    # Prepare a BK Tree if we're doing similarity grouping
-    if similarity:
-        tree = pybktree.BKTree(
-            lambda a, b: Levenshtein.distance(a, b) / max(len(a), len(b))
-        )
+    # Prepare a BK Tree if we're doing similarity grouping. Items are
+    # (content, index) pairs and only the content is compared.
+    use_bktree = similarity and similarity_backend == "bktree"
+    if use_bktree:
+        tree = pybktree.BKTree(lambda a, b: normalized_distance(a[0], b[0]))
 
-    # Initialize a union-find data structure
-    uf = unionfind.UnionFind()
+    # Initialize a union-find data structure indexed by position in files
+    uf = DisjointSet(len(files))
 
     # Track the first schema added to each org so we can group them
     org_map = {}
 
     sys.stderr.write("Grouping by repository…\n")
-    for schema_file in tqdm.tqdm(files):
-        path_str = str(schema_file)
-
+    for i, schema_file in enumerate(tqdm.tqdm(files)):
         # Get the organization name from the path
         org = schema_file.parts[1:3]
 
-        uf.add(str(schema_file))
         if org not in org_map:
             # Track the first schema for this organization
-            org_map[org] = str(schema_file)
+            org_map[org] = i
         else:
             # Merge with the previous group if this
             # organization has been seen before
-            uf.union(org_map[org], str(schema_file))
+            uf.union(org_map[org], i)
 
         # Add to the BK Tree
-        if similarity:
-            tree.add((str(schema_file), open(schema_file).read().strip()))
+        if use_bktree:
+            tree.add((open(schema_file).read().strip(), i))
 
     del org_map
 
     # Optionally group together similar files
-    if similarity:
+    if similarity and similarity_backend == "minhash":
+        sys.stderr.write("Grouping similar files…\n")
+        group_near_duplicates(uf, [str(f) for f in files], similarity, verify, workers)
+    elif use_bktree:
         sys.stderr.write("Grouping similar files…\n")
-        for schema_file in tqdm.tqdm(files):
-            path_str = str(schema_file)
+        for i, schema_file in enumerate(tqdm.tqdm(files)):
             data = open(schema_file).read().strip()
 
             # Find similar schemas for this schema and group them together
-            for other_path, _ in tree.find(data, similarity):
-                uf.union(path_str, other_path)
-
-    # Produce a list of schemas and their associated groups
-    all_schemas = list()
-    schema_groups = list()
-    for group, schemas in enumerate(uf.components()):
-        all_schemas.extend(schemas)
-        schema_groups.extend([group] * len(schemas))
-
-    # Split the schemas into training and test
-    all_schemas = np.array(all_schemas)
-    schema_groups = np.array(schema_groups)
-    gss = GroupShuffleSplit(n_splits=1, train_size=split, random_state=seed)
-    (train_indexes, test_indexes) = next(gss.split(all_schemas, groups=schema_groups))
-
-    test_schemas = all_schemas[test_indexes]
-    test_groups = schema_groups[test_indexes]
-    gss = GroupShuffleSplit(n_splits=1, train_size=0.5, random_state=seed)
-    (test_indexes, val_indexes) = next(gss.split(test_schemas, groups=test_groups))
+            for _, (_, other) in tree.find((data, i), similarity):
+                uf.union(i, other)
+
+    # Key each group by its first repository in sorted order, which only
+    # changes if the group is merged with another one
+    roots = uf.roots()
+    group_keys = {}
+    for schema_file, root in zip(files, roots):
+        org = "/".join(schema_file.parts[1:3])
+        if root not in group_keys or org < group_keys[root]:
+            group_keys[root] = org
+
+    # Split the schemas into training, test and validation by group
+    splits = {"train": [], "test": [], "validation": []}
+    group_splits = {root: assign_split(key, split, seed) for root, key in group_keys.items()}
+    for schema_file, root in zip(files, roots):
+        splits[group_splits[root]].append(schema_file)
 
     schema_data = {}
     with open(commits_file) as f:
@@ -153,15 +205,18 @@ def main(similarity, split, seed, commits_file, licenses_file, languages_file):
                 obj["language"] = languages.get(obj["repository"])
                 schema_data[filename] = obj
 
-    # Write the train and test sets
-    write_schemas("train.jsonl.gz", all_schemas[train_indexes], schema_data)
-    write_schemas("test.jsonl.gz", test_schemas[test_indexes], schema_data)
-    write_schemas("validation.jsonl.gz", test_schemas[val_indexes], schema_data)
+    # Write the train, test and validation sets
+    for name, schemas in splits.items():
+        write_schemas(name + ".jsonl.gz", schemas, schema_data)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--similarity", default=None, type=float)
+    parser.add_argument("--similarity_backend", default="bktree", choices=["bktree", "minhash"])
+    parser.add_argument("--verify", action="store_true",
+                        help="check minhash candidates with the normalized edit distance")
+    parser.add_argument("--workers", default=None, type=int)
     parser.add_argument("--seed", default=38, type=int)
     parser.add_argument("--split", default=0.8, type=float)
     parser.add_argument("--commits_file", default="commits.json")
@@ -175,4 +230,7 @@ if __name__ == "__main__":
         args.commits_file,
         args.licenses_file,
         args.languages_file,
+        args.similarity_backend,
+        args.verify,
+        args.workers,
     )
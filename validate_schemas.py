@@ -1,12 +1,18 @@
+import argparse
+from collections import Counter
+import hashlib
 import json
 import os
 from pathlib import Path
+import shutil
 import sys
 
-import json5
 import jsonschema
+import tqdm
 from tqdm.contrib.concurrent import process_map
 
+from json_parsing import load_json, read_jsonl
+
 
 IGNORE_PATHS = [
     "node_modules",
@@ -18,42 +24,134 @@ IGNORE_PATHS = [
 ]
 
 
-def process_file(schema_file):
-    # Calculate the path of the new file
-    new_schema_file = Path("valid_data", *schema_file.parts[1:])
-
+def hash_schema_file(schema_file):
+    """Return the sha256 of a schema file's content, or None if it is skipped."""
     # Skip any directories named with .json at the end
-    if not schema_file.is_file() and not new_schema_file.is_file():
-        return
+    if not schema_file.is_file():
+        return None
 
     # Skip files in ignored directories
     for path in IGNORE_PATHS:
-        if path in schema_file.parts or path in new_schema_file.parts:
-            return
+        if path in schema_file.parts:
+            return None
+
+    with open(schema_file, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_blob_file(cache_folder, content_hash):
+    return os.path.join(cache_folder, "blobs", content_hash[:2], content_hash + ".json")
 
+
+def validate_blob(args):
+    """
+    Validate one schema and return its verdict. Valid schemas are written to
+    blob_file so every copy of the same content can be linked to it.
+    """
+    schema_file, blob_file = args
     try:
-        schema = json5.load(open(schema_file))
+        schema, parser = load_json(schema_file, allow_json5=True)
     except ValueError:
-        return
+        return {"verdict": "invalid_json", "parser": None}
 
     # Skip meta schemas
-    if schema.get("$id").startswith("https://json-schema.org/"):
-        return
+    schema_id = schema.get("$id") if isinstance(schema, dict) else None
+    if isinstance(schema_id, str) and schema_id.startswith("https://json-schema.org/"):
+        return {"verdict": "meta_schema", "parser": parser}
 
     vcls = jsonschema.validators.validator_for(schema)
     try:
         vcls.check_schema(schema)
     except jsonschema.exceptions.SchemaError:
-        return
+        return {"verdict": "schema_error", "parser": parser}
+
+    # Write to a temporary file so an interrupted run never leaves a partial blob
+    os.makedirs(os.path.dirname(blob_file), exist_ok=True)
+    with open(blob_file + ".tmp", "w") as f:
+        json.dump(schema, f, sort_keys=True, indent=2)
+    os.replace(blob_file + ".tmp", blob_file)
+    return {"verdict": "valid", "parser": parser}
+
+
+def load_verdicts(verdicts_file):
+    verdicts = {}
+    for obj in read_jsonl(verdicts_file):
+        verdicts[obj.pop("hash")] = obj
+    return verdicts
+
 
-    new_schema_file = Path("valid_data", *schema_file.parts[1:])
-    Path.mkdir(new_schema_file.parent, parents=True, exist_ok=True)
-    json.dump(schema, open(new_schema_file, "w"), sort_keys=True, indent=2)
+def link_schema(blob_file, new_schema_file):
+    """Hard link a validated blob into valid_data, copying when linking fails."""
+    new_schema_file.parent.mkdir(parents=True, exist_ok=True)
+    if new_schema_file.exists():
+        if os.path.samefile(blob_file, new_schema_file):
+            return
+        new_schema_file.unlink()
+
+    try:
+        os.link(blob_file, new_schema_file)
+    except OSError:
+        shutil.copyfile(blob_file, new_schema_file)
+
+
+def validate_schemas(files, cache_folder="validation_cache", workers=None):
+    """
+    Validate schema files, checking each distinct content only once. Verdicts
+    are kept in cache_folder across runs and valid schemas are materialized
+    in valid_data as links to a single blob per content hash.
+    """
+    os.makedirs(cache_folder, exist_ok=True)
+    verdicts_file = os.path.join(cache_folder, "verdicts.jsonl")
+    verdicts = load_verdicts(verdicts_file)
+
+    hashes = process_map(hash_schema_file, files, max_workers=workers, chunksize=100)
+
+    # Pick one file per content hash which has no usable verdict yet
+    pending = {}
+    for schema_file, content_hash in zip(files, hashes):
+        if content_hash is None or content_hash in pending:
+            continue
+        verdict = verdicts.get(content_hash)
+        if verdict is None or (verdict["verdict"] == "valid"
+                               and not os.path.isfile(get_blob_file(cache_folder, content_hash))):
+            pending[content_hash] = schema_file
+
+    results = process_map(
+        validate_blob,
+        [(schema_file, get_blob_file(cache_folder, content_hash))
+         for content_hash, schema_file in pending.items()],
+        max_workers=workers,
+        chunksize=10,
+    )
+    with open(verdicts_file, "a") as f:
+        for content_hash, verdict in zip(pending, results):
+            verdicts[content_hash] = verdict
+            f.write(json.dumps({"hash": content_hash, **verdict}) + "\n")
+
+    parsers = Counter()
+    for schema_file, content_hash in zip(tqdm.tqdm(files), hashes):
+        if content_hash is None:
+            continue
+        verdict = verdicts[content_hash]
+        parsers[verdict["parser"] or "invalid"] += 1
+        if verdict["verdict"] == "valid":
+            new_schema_file = Path("valid_data", *schema_file.parts[1:])
+            link_schema(get_blob_file(cache_folder, content_hash), new_schema_file)
+
+    distinct = len(set(hashes) - {None})
+    print(f"{sum(parsers.values())} files, {distinct} distinct, {len(pending)} validated in this run")
+    return parsers
 
 
 if __name__ == "__main__":
     # Increase the recursion limit to handle large schemas
     sys.setrecursionlimit(10000)
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cache_folder", default="validation_cache")
+    parser.add_argument("--workers", default=None, type=int)
+    args = parser.parse_args()
+
     data_path = Path("fetched_data")
-    process_map(process_file, list(data_path.rglob("*.json")), chunksize=10)
+    parsers = validate_schemas(list(data_path.rglob("*.json")), args.cache_folder, args.workers)
+    print("Files by parser: " + ", ".join(f"{name} {count}" for name, count in parsers.most_common()))